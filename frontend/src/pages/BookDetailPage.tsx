@@ -20,7 +20,7 @@ export default function BookDetailPage() {
     const fetchBook = async () => {
       setLoading(true);
       try {
-        const res = await api.get<Book>(API_PATHS.BOOK_DETAIL(id));
+        const res = await api.get<Book>(API_PATHS.BOOK_DETAIL(id), { params: { expand: 'book_instances' } });
         setBook(res);
       } catch (err) {
         setError('Book not found');
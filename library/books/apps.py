@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, using, **kwargs):
+    from .search import ensure_search_index
+    ensure_search_index(using)
+
+
+def create_open_loan_constraint(sender, using, **kwargs):
+    from .loans import ensure_open_loan_constraint
+    ensure_open_loan_constraint(using)
 
 
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        post_migrate.connect(create_search_index, sender=self)
+        post_migrate.connect(create_open_loan_constraint, sender=self)
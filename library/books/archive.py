@@ -0,0 +1,104 @@
+"""
+Move closed loan history out of the hot ``book_instance_history`` table.
+
+Closed rows older than the configured age are copied into
+``book_instance_history_archive`` with ``INSERT ... SELECT`` and then deleted.
+Each batch of ids runs in its own transaction. With compaction only the
+borrow row of each loan is kept. Since a return closes the borrow row with
+its ``returned_date``, that row already describes the whole loan, and the
+separate return rows are dropped.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BookInstance, BookInstanceHistory, BookInstanceHistoryArchive
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+# Columns copied as they are from the hot table
+COPIED_FIELDS = ['id', 'book_instance', 'status', 'user', 'borrowed_date', 'due_date', 'returned_date']
+
+
+def archive_after():
+    """How long closed history stays in the hot table."""
+    return timedelta(days=getattr(settings, 'HISTORY_ARCHIVE_AFTER_DAYS', 365))
+
+
+def archive_horizon():
+    """Rows borrowed on or after this moment are never in the archive."""
+    return timezone.now() - archive_after()
+
+
+def archivable(cutoff):
+    """Closed history rows that were closed before ``cutoff``."""
+    return BookInstanceHistory.objects.filter(is_returned=True).filter(
+        Q(returned_date__lt=cutoff) | Q(returned_date__isnull=True, borrowed_date__lt=cutoff)
+    )
+
+
+def _column(model, name, quote):
+    return quote(model._meta.get_field(name).column)
+
+
+def _move_batch(connection, ids, compact, now):
+    quote = connection.ops.quote_name
+    history = quote(BookInstanceHistory._meta.db_table)
+    archive = quote(BookInstanceHistoryArchive._meta.db_table)
+    instances = quote(BookInstance._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+
+    target = [_column(BookInstanceHistoryArchive, name, quote) for name in COPIED_FIELDS]
+    target += [_column(BookInstanceHistoryArchive, 'book', quote), _column(BookInstanceHistoryArchive, 'archived_at', quote)]
+    source = [f"h.{_column(BookInstanceHistory, name, quote)}" for name in COPIED_FIELDS]
+    source += [f"bi.{_column(BookInstance, 'book', quote)}", '%s']
+    condition = f"h.{quote('id')} IN ({placeholders})"
+    if compact:
+        condition += f" AND h.{_column(BookInstanceHistory, 'borrowed_date', quote)} IS NOT NULL"
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {archive} ({', '.join(target)}) "
+            f"SELECT {', '.join(source)} FROM {history} h "
+            f"LEFT JOIN {instances} bi ON bi.{quote('id')} = h.{_column(BookInstanceHistory, 'book_instance', quote)} "
+            f"WHERE {condition}",
+            [connection.ops.adapt_datetimefield_value(now), *ids]
+        )
+        archived = cursor.rowcount
+        cursor.execute(f"DELETE FROM {history} WHERE {quote('id')} IN ({placeholders})", ids)
+        return cursor.rowcount, archived
+
+
+def archive_history(older_than=None, compact=None, batch_size=ARCHIVE_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """
+    Archive closed history older than ``older_than`` (default from settings).
+
+    Returns ``(moved, archived)``. ``moved`` counts rows removed from the hot
+    table and ``archived`` counts rows written to the archive. The two differ
+    only when compacting.
+    """
+    if compact is None:
+        compact = getattr(settings, 'HISTORY_ARCHIVE_COMPACT', False)
+    now = timezone.now()
+    cutoff = now - (older_than if older_than is not None else archive_after())
+    candidates = archivable(cutoff).using(using).order_by('id').values_list('id', flat=True)
+    connection = connections[using]
+
+    moved = archived = 0
+    last_id = 0
+    while True:
+        ids = list(candidates.filter(id__gt=last_id)[:batch_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+        with transaction.atomic(using=using):
+            batch_moved, batch_archived = _move_batch(connection, ids, compact, now)
+        moved += batch_moved
+        archived += batch_archived
+
+    logger.info(f"Archived {archived} history rows, removed {moved} from the hot table")
+    return moved, archived
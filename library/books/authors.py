@@ -0,0 +1,104 @@
+"""
+Author resolution for book imports.
+
+``AuthorResolver`` maps full author names to Author ids. Names match on
+``(given_names, surname)`` with whitespace collapsed and case ignored. Names
+the resolver has not seen yet are looked up with one query per batch, and
+missing authors are bulk inserted with deterministic slugs, so concurrent
+imports of the same name settle on one row instead of failing on the unique
+slug. Resolved ids are kept in an LRU for the life of the resolver, typically
+one import task.
+"""
+import hashlib
+from collections import OrderedDict
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils.text import slugify
+
+from .models import Author
+
+AUTHOR_CACHE_SIZE = 10000
+
+
+def author_key(given_names, surname):
+    """The normalized ``(given_names, surname)`` that author names are matched on."""
+    return ' '.join(given_names.split()).lower(), ' '.join(surname.split()).lower()
+
+
+def author_slug(given_names, surname, qualified=False):
+    """
+    The slug of a new author. ``qualified`` adds a hash of the author key, for
+    names whose plain slug already belongs to a different author.
+    """
+    slug = slugify(f"{given_names} {surname}")
+    if qualified:
+        digest = hashlib.sha1('\x1f'.join(author_key(given_names, surname)).encode()).hexdigest()[:8]
+        slug = f"{slug}-{digest}"
+    return slug
+
+
+class AuthorResolver:
+    def __init__(self, maxsize=AUTHOR_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()  # author key -> id, least recently used first
+
+    def resolve(self, names):
+        """
+        Return ``{name: author_id}`` for full author names, inserting the
+        authors that do not exist yet. Ids are cached once the current
+        transaction commits.
+        """
+        keys = {}
+        for name in names:
+            given_names, surname = Author.split_name(name)
+            keys[name] = author_key(given_names, surname), given_names, surname
+
+        ids = {}
+        missing = {}
+        for key, given_names, surname in keys.values():
+            if key in self._ids:
+                self._ids.move_to_end(key)
+                ids[key] = self._ids[key]
+            else:
+                missing.setdefault(key, (given_names, surname))
+        if missing:
+            loaded = self._load(missing)
+            ids.update(loaded)
+            transaction.on_commit(lambda: self._remember(loaded))
+        return {name: ids[key] for name, (key, _, _) in keys.items()}
+
+    def _load(self, missing):
+        """
+        Find or insert the authors for ``{key: (given_names, surname)}``.
+        Returns ``{key: id}``.
+        """
+        found = {}
+        existing = Author.objects.annotate(surname_key=Lower('surname')).filter(
+            surname_key__in={surname for _, surname in missing}
+        ).order_by('id')
+        for author_id, given_names, surname in existing.values_list('id', 'given_names', 'surname'):
+            key = author_key(given_names, surname)
+            if key in missing:
+                found.setdefault(key, author_id)
+
+        # A plain slug taken by a different author is retried with a qualified one.
+        for qualified in (False, True):
+            new = {key: names for key, names in missing.items() if key not in found}
+            if not new:
+                break
+            authors = {}
+            for key, (given_names, surname) in sorted(new.items()):
+                slug = author_slug(given_names, surname, qualified)
+                authors.setdefault(slug, Author(given_names=given_names, surname=surname, slug=slug))
+            Author.objects.bulk_create(authors.values(), ignore_conflicts=True)
+            stored = Author.objects.filter(slug__in=authors).order_by('id')
+            for author_id, given_names, surname in stored.values_list('id', 'given_names', 'surname'):
+                key = author_key(given_names, surname)
+                if key in new:
+                    found.setdefault(key, author_id)
+        return found
+
+    def _remember(self, ids):
+        self._ids.update(ids)
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
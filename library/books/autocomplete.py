@@ -0,0 +1,175 @@
+"""
+In-process prefix index for search-as-you-type on titles and author names.
+
+Normalized labels are kept in one sorted list, so a lookup is a binary search
+followed by a short scan. The index is loaded lazily on first use and updated
+in place from the ``books.signals`` handlers when a title or author name
+changes. Other processes learn about changes through a version counter in the
+cache and reload in a background thread when it moves, serving the old index
+until the new one is ready.
+"""
+import bisect
+import threading
+import logging
+from time import monotonic
+from django.conf import settings
+from django.db import connection
+
+from . import cache as book_cache
+from .fuzzy import normalize
+from .models import Author, Book
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'books:autocomplete:version'
+
+
+def loaded_label(kind, obj):
+    """The label of a book or author as it was loaded, without querying deferred fields."""
+    fields = obj.__dict__
+    if kind == 'book':
+        return fields.get('title')
+    if 'given_names' in fields and 'surname' in fields:
+        return f"{fields['given_names']} {fields['surname']}".strip()
+    return None
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []       # sorted normalized labels
+        self._entries = []    # (kind, id, label), parallel to _keys
+        self._by_object = {}  # (kind, id) -> keys, for in-place updates
+        self.loaded = False
+        self.version = None
+        self._checked_at = 0.0
+        self._reloading = False
+
+    @staticmethod
+    def _labels(kind, obj):
+        if kind == 'book':
+            return obj.title, [normalize(obj.title)]
+        label = f"{obj.given_names} {obj.surname}".strip()
+        # Authors can be typed given names first or surname first.
+        return label, list({normalize(label), normalize(f"{obj.surname} {obj.given_names}".strip())})
+
+    def load(self):
+        """Build the index from the database."""
+        version = book_cache.get_cache().get(VERSION_KEY, 0)
+        rows = []
+        for book in Book.objects.order_by().only('id', 'title').iterator(chunk_size=5000):
+            label, keys = self._labels('book', book)
+            rows.extend((key, ('book', book.id, label)) for key in keys)
+        for author in Author.objects.order_by().only('id', 'given_names', 'surname').iterator(chunk_size=5000):
+            label, keys = self._labels('author', author)
+            rows.extend((key, ('author', author.id, label)) for key in keys)
+        rows.sort(key=lambda row: row[0])
+
+        by_object = {}
+        for key, (kind, obj_id, _) in rows:
+            by_object.setdefault((kind, obj_id), []).append(key)
+        with self._lock:
+            self._keys = [key for key, _ in rows]
+            self._entries = [entry for _, entry in rows]
+            self._by_object = by_object
+            self.version = version
+            self.loaded = True
+            self._checked_at = monotonic()
+        logger.info(f"Loaded autocomplete index with {len(rows)} entries")
+
+    def _ensure_fresh(self):
+        if not self.loaded:
+            # Nothing to serve yet, so the first load happens in the request.
+            self.load()
+            return
+        interval = getattr(settings, 'AUTOCOMPLETE_CHECK_INTERVAL', 5)
+        if monotonic() - self._checked_at < interval:
+            return
+        self._checked_at = monotonic()
+        if book_cache.get_cache().get(VERSION_KEY, 0) != self.version:
+            self._reload_in_background()
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._background_load, name='autocomplete-reload', daemon=True).start()
+
+    def _background_load(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Failed to reload the autocomplete index")
+        finally:
+            self._reloading = False
+            connection.close()
+
+    def _remove(self, kind, obj_id):
+        for key in self._by_object.pop((kind, obj_id), []):
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._entries[i][:2] == (kind, obj_id):
+                    del self._keys[i]
+                    del self._entries[i]
+                    break
+                i += 1
+
+    def _publish_change(self):
+        # Tell other processes to reload. Keep our own version in step unless
+        # somebody else changed the catalog in the meantime.
+        new_version = book_cache.incr(VERSION_KEY)
+        if self.version == new_version - 1:
+            self.version = new_version
+
+    def update(self, kind, obj, created=False):
+        """Insert or replace the entries of a saved book or author if its label changed."""
+        label, keys = self._labels(kind, obj)
+        if not created and label == getattr(obj, '_autocomplete_label', None):
+            return
+        obj._autocomplete_label = label
+        with self._lock:
+            if self.loaded:
+                self._remove(kind, obj.pk)
+                for key in keys:
+                    i = bisect.bisect_right(self._keys, key)
+                    self._keys.insert(i, key)
+                    self._entries.insert(i, (kind, obj.pk, label))
+                self._by_object[(kind, obj.pk)] = keys
+            self._publish_change()
+
+    def invalidate(self):
+        """
+        Reload the index in every process, this one included, after changes too
+        large to apply in place. Lookups keep using the current index meanwhile.
+        """
+        book_cache.incr(VERSION_KEY)
+        self._checked_at = 0.0
+
+    def remove(self, kind, obj_id):
+        """Drop the entries of a deleted book or author."""
+        with self._lock:
+            if self.loaded:
+                self._remove(kind, obj_id)
+            self._publish_change()
+
+    def complete(self, prefix, limit=10):
+        """Return up to ``limit`` distinct entries whose label starts with ``prefix``."""
+        prefix = normalize(prefix).strip()
+        if not prefix:
+            return []
+        self._ensure_fresh()
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, prefix)
+            while i < len(self._keys) and self._keys[i].startswith(prefix) and len(results) < limit:
+                kind, obj_id, label = self._entries[i]
+                if (kind, obj_id) not in seen:
+                    seen.add((kind, obj_id))
+                    results.append({'type': kind, 'id': obj_id, 'label': label})
+                i += 1
+        return results
+
+
+index = AutocompleteIndex()
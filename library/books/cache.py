@@ -0,0 +1,119 @@
+"""
+Read-through response cache for the book list and detail endpoints.
+
+Cache keys embed version counters rather than being deleted on writes: each
+book has its own version and every list page shares the catalog generation.
+The handlers in ``books.signals`` bump those counters, which orphans the stale
+entries until they expire.
+"""
+import hashlib
+import logging
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+CATALOG_GENERATION_KEY = 'books:catalog:generation'
+HITS_KEY = 'books:cache:hits'
+MISSES_KEY = 'books:cache:misses'
+# Query parameters that change the page but not the facet counts.
+FACET_IGNORED_PARAMS = ['cursor', 'page_size', 'count', 'fields', 'expand']
+
+
+def get_cache():
+    return caches[getattr(settings, 'BOOK_CACHE_ALIAS', 'default')]
+
+
+def _book_version_key(book_id):
+    return f'books:book:{book_id}:version'
+
+
+def incr(key):
+    """Increment a counter in the book cache, creating it if needed."""
+    cache = get_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The counter was evicted between add() and incr().
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def _bump(book_ids):
+    for book_id in book_ids:
+        incr(_book_version_key(book_id))
+    incr(CATALOG_GENERATION_KEY)
+
+
+def invalidate_books(book_ids):
+    """Invalidate the detail entries of the given books and every list page."""
+    book_ids = list(book_ids)
+    _bump(book_ids)
+    # Bump again once the transaction commits, so a read that raced the write
+    # cannot leave pre-commit data cached under the new version.
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(book_ids))
+
+
+def _request_hash(request):
+    return hashlib.md5(f"{request.get_host()}{request.get_full_path()}".encode('utf-8')).hexdigest()
+
+
+def book_key(request, book_id):
+    version = get_cache().get(_book_version_key(book_id), 0)
+    return f'books:book:{book_id}:v{version}:{_request_hash(request)}'
+
+
+def catalog_key(request):
+    generation = get_cache().get(CATALOG_GENERATION_KEY, 0)
+    return f'books:catalog:g{generation}:{_request_hash(request)}'
+
+
+def validators_key(request, book_id=None):
+    """Key for the ETag and Last-Modified of a list request, or of one book's detail request."""
+    key = catalog_key(request) if book_id is None else book_key(request, book_id)
+    return f'books:validators:{key}'
+
+
+def facets_key(request):
+    """Key for the facet counts of a list or search request, ignoring paging and field selection."""
+    generation = get_cache().get(CATALOG_GENERATION_KEY, 0)
+    params = request.GET.copy()
+    for param in FACET_IGNORED_PARAMS:
+        params.pop(param, None)
+    digest = hashlib.md5(f"{request.path}?{params.urlencode()}".encode('utf-8')).hexdigest()
+    return f'books:facets:g{generation}:{digest}'
+
+
+def cached_response(key, render):
+    """
+    Return the cached response data under ``key``, or call ``render`` and cache
+    its data if it succeeded. Sets an ``X-Cache`` header of HIT or MISS.
+    """
+    cache = get_cache()
+    data = cache.get(key)
+    if data is not None:
+        incr(HITS_KEY)
+        return Response(data, headers={'X-Cache': 'HIT'})
+
+    incr(MISSES_KEY)
+    response = render()
+    if response.status_code == 200:
+        cache.set(key, response.data, timeout=getattr(settings, 'BOOK_CACHE_TIMEOUT', 300))
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def get_stats():
+    """Return the hit and miss counters and the hit ratio."""
+    counters = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
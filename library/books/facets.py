@@ -0,0 +1,46 @@
+"""
+Facet counts (language, publication decade, availability) for book listings.
+
+All three facets come from one grouped aggregate over the filtered queryset,
+cached per query string until the catalog changes.
+"""
+from collections import Counter
+from django.conf import settings
+from django.db.models import BooleanField, Case, Count, F, IntegerField, When
+from django.db.models.functions import Cast, Floor
+
+from . import cache as book_cache
+
+
+def compute_facets(queryset):
+    """Return the facet counts of ``queryset`` using a single GROUP BY query."""
+    rows = queryset.prefetch_related(None).order_by().values(
+        'language',
+        # Floor rather than integer division, which truncates years BC towards zero.
+        decade=Cast(Floor(F('publication_year') / 10.0) * 10, output_field=IntegerField()),
+        available=Case(When(available_count__gt=0, then=True), default=False, output_field=BooleanField()),
+    ).annotate(count=Count('id'))
+
+    languages, decades, availability = Counter(), Counter(), Counter()
+    for row in rows:
+        languages[row['language']] += row['count']
+        if row['decade'] is not None:
+            decades[row['decade']] += row['count']
+        availability[row['available']] += row['count']
+
+    return {
+        'language': [{'value': value, 'count': count} for value, count in languages.most_common()],
+        'decade': [{'value': value, 'count': decades[value]} for value in sorted(decades)],
+        'available': [{'value': value, 'count': availability[value]} for value in (True, False) if availability[value]],
+    }
+
+
+def get_facets(request, queryset):
+    """Return the cached facet counts for this request, computing them on a miss."""
+    cache = book_cache.get_cache()
+    key = book_cache.facets_key(request)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, timeout=getattr(settings, 'BOOK_CACHE_TIMEOUT', 300))
+    return facets
@@ -0,0 +1,17 @@
+import django_filters
+
+from .models import Book
+
+
+class BookFilter(django_filters.FilterSet):
+    """Filters for the book list. ``available`` uses the stored available_count."""
+    available = django_filters.BooleanFilter(method='filter_available')
+
+    class Meta:
+        model = Book
+        fields = ['language']
+
+    def filter_available(self, queryset, name, value):
+        if value:
+            return queryset.filter(available_count__gt=0)
+        return queryset.filter(available_count=0)
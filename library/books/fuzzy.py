@@ -0,0 +1,182 @@
+"""
+Typo-tolerant search over book titles and author names.
+
+Every distinct word in the catalog is stored once as a ``SearchTerm`` together
+with its trigrams. A query word is matched against the vocabulary through the
+trigram index and scored by trigram (Jaccard) similarity, so "Dostoyevsky"
+still finds "Dostoevsky". The index is updated incrementally from
+``books.signals`` as books and authors change, and words no book uses any
+more are dropped, so stale terms do not crowd out real candidates.
+"""
+import re
+import unicodedata
+import logging
+from collections import defaultdict
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Case, Count, FloatField, Value, When
+
+from .models import Book, SearchTerm, SearchTrigram
+
+logger = logging.getLogger(__name__)
+
+# Minimum trigram similarity for a vocabulary term to count as a match.
+SIMILARITY_THRESHOLD = 0.3
+# Candidate terms kept per query word, and books returned per query.
+TERMS_PER_WORD = 20
+RESULT_LIMIT = 200
+BATCH_SIZE = 500
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    """Lowercase ``text`` and strip diacritics, so "Brontë" becomes "bronte"."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def words(text):
+    """Return the normalized words of ``text`` worth indexing."""
+    return [word[:100] for word in WORD_RE.findall(normalize(text)) if len(word) > 1]
+
+
+def trigrams(word):
+    """Return the set of trigrams of a word, padded like pg_trgm."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _get_or_create_terms(all_words, using):
+    """Return ``{word: SearchTerm id}``, creating missing terms and their trigrams."""
+    all_words = list(all_words)
+    term_ids = {}
+    for i in range(0, len(all_words), BATCH_SIZE):
+        batch = all_words[i:i + BATCH_SIZE]
+        term_ids.update(SearchTerm.objects.using(using).filter(term__in=batch).values_list('term', 'id'))
+
+    missing = [word for word in all_words if word not in term_ids]
+    if missing:
+        SearchTerm.objects.using(using).bulk_create(
+            [SearchTerm(term=word, gram_count=len(trigrams(word))) for word in missing],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        created = {}
+        for i in range(0, len(missing), BATCH_SIZE):
+            batch = missing[i:i + BATCH_SIZE]
+            created.update(SearchTerm.objects.using(using).filter(term__in=batch).values_list('term', 'id'))
+        SearchTrigram.objects.using(using).bulk_create(
+            [SearchTrigram(trigram=gram, term_id=term_id) for word, term_id in created.items() for gram in trigrams(word)],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        term_ids.update(created)
+    return term_ids
+
+
+def _drop_unused_terms(term_ids, using):
+    """Delete the given terms, and their trigrams, if no book uses them any more."""
+    term_ids = list(term_ids)
+    for i in range(0, len(term_ids), BATCH_SIZE):
+        SearchTerm.objects.using(using).filter(id__in=term_ids[i:i + BATCH_SIZE], books__isnull=True).delete()
+
+
+def index_books(book_ids, using=DEFAULT_DB_ALIAS):
+    """(Re-)index the vocabulary of the given books, dropping the words they no longer use."""
+    from .search import _documents
+
+    book_ids = list(set(book_ids))
+    Through = SearchTerm.books.through
+    for i in range(0, len(book_ids), BATCH_SIZE):
+        batch = book_ids[i:i + BATCH_SIZE]
+        book_words = {
+            book_id: set(words(f"{title} {authors}"))
+            for book_id, title, authors in _documents(batch)
+        }
+        term_ids = _get_or_create_terms(set().union(*book_words.values()), using)
+        links = Through.objects.using(using).filter(book_id__in=batch)
+        old_term_ids = set(links.values_list('searchterm_id', flat=True))
+        links.delete()
+        Through.objects.using(using).bulk_create(
+            [Through(book_id=book_id, searchterm_id=term_ids[word]) for book_id, ws in book_words.items() for word in ws],
+            batch_size=BATCH_SIZE
+        )
+        _drop_unused_terms(old_term_ids - set(term_ids.values()), using)
+
+
+def remove_books(book_ids, using=DEFAULT_DB_ALIAS):
+    """Unlink the given books from the vocabulary and drop the terms only they used."""
+    book_ids = list(set(book_ids))
+    Through = SearchTerm.books.through
+    for i in range(0, len(book_ids), BATCH_SIZE):
+        links = Through.objects.using(using).filter(book_id__in=book_ids[i:i + BATCH_SIZE])
+        term_ids = set(links.values_list('searchterm_id', flat=True))
+        links.delete()
+        _drop_unused_terms(term_ids, using)
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS):
+    """Rebuild the vocabulary from scratch, dropping terms no book uses any more."""
+    SearchTerm.objects.using(using).all().delete()
+    book_ids = list(Book.objects.using(using).values_list('id', flat=True))
+    index_books(book_ids, using)
+    return len(book_ids)
+
+
+def _matching_terms(word, using):
+    """Return ``{term_id: similarity}`` for vocabulary terms similar to ``word``."""
+    grams = trigrams(word)
+    # Jaccard similarity >= t requires at least t * |grams| shared trigrams.
+    min_shared = max(1, int(SIMILARITY_THRESHOLD * len(grams)))
+    candidates = (
+        SearchTrigram.objects.using(using)
+        .filter(trigram__in=grams)
+        .values('term_id', 'term__gram_count')
+        .annotate(shared=Count('id'))
+        .filter(shared__gte=min_shared)
+    )
+    scored = {}
+    for candidate in candidates:
+        shared = candidate['shared']
+        similarity = shared / (len(grams) + candidate['term__gram_count'] - shared)
+        if similarity >= SIMILARITY_THRESHOLD:
+            scored[candidate['term_id']] = similarity
+    best = sorted(scored.items(), key=lambda item: -item[1])[:TERMS_PER_WORD]
+    return dict(best)
+
+
+def search_books(queryset, query, using=DEFAULT_DB_ALIAS):
+    """
+    Filter ``queryset`` to books with words similar to those in ``query``.
+
+    A book scores the sum, over query words, of its best matching term's
+    similarity. Only the ``RESULT_LIMIT`` best books are returned.
+    """
+    query_words = words(query)
+    if not query_words:
+        return queryset.none()
+
+    Through = SearchTerm.books.through
+    scores = defaultdict(float)
+    for word in query_words:
+        matches = _matching_terms(word, using)
+        if not matches:
+            continue
+        best_per_book = {}
+        rows = Through.objects.using(using).filter(searchterm_id__in=matches).values_list('book_id', 'searchterm_id')
+        for book_id, term_id in rows:
+            best_per_book[book_id] = max(best_per_book.get(book_id, 0), matches[term_id])
+        for book_id, similarity in best_per_book.items():
+            scores[book_id] += similarity
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:RESULT_LIMIT]
+    if not ranked:
+        return queryset.none()
+
+    rank = Case(
+        *[When(id=book_id, then=Value(score)) for book_id, score in ranked],
+        output_field=FloatField()
+    )
+    return queryset.filter(id__in=[book_id for book_id, _ in ranked]).annotate(
+        search_rank=rank
+    ).order_by('-search_rank', 'id')
@@ -0,0 +1,121 @@
+"""
+FIFO hold queue on top of ``UserWishlist``.
+
+A book's wishlist entries are its hold queue, oldest first, read through the
+``(book, created_at)`` index. A copy that comes back while people are waiting
+is reserved (``BookStatus.RESERVED``) for the first entry without a hold until
+``hold_expires_at``. Only the holder can borrow it. ``expire_holds`` drops
+expired entries in batches and passes their copies to the next in line.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache as book_cache
+from .models import Book, BookInstance, BookStatus
+from users.models import UserWishlist
+
+HOLD_PERIOD = timedelta(days=3)
+EXPIRY_BATCH_SIZE = 500
+
+
+def queue(book_id):
+    """The book's wishlist entries in the order they are served."""
+    return UserWishlist.objects.filter(book_id=book_id).order_by('created_at', 'id')
+
+
+def reserve_for_queue(copies, now=None):
+    """
+    Hold copies that have just become free for the heads of their books' queues.
+
+    ``copies`` maps ids of copies already marked available to their book ids.
+    Copies given a hold are marked reserved and the rest are added to the
+    books' available counters. Must run inside a transaction. Returns the
+    wishlist entries that received a hold.
+    """
+    now = now or timezone.now()
+    by_book = defaultdict(list)
+    for copy_id, book_id in copies.items():
+        by_book[book_id].append(copy_id)
+
+    holds = []
+    for book_id, copy_ids in by_book.items():
+        waiting = queue(book_id).select_for_update().filter(held_copy__isnull=True)[:len(copy_ids)]
+        for entry, copy_id in zip(waiting, sorted(copy_ids)):
+            entry.held_copy_id = copy_id
+            entry.hold_expires_at = now + HOLD_PERIOD
+            holds.append(entry)
+
+    if holds:
+        UserWishlist.objects.bulk_update(holds, ['held_copy', 'hold_expires_at'])
+        BookInstance.objects.filter(pk__in=[entry.held_copy_id for entry in holds]).update(
+            status=BookStatus.RESERVED, updated_at=now
+        )
+    held = {entry.held_copy_id for entry in holds}
+    freed = Counter(book_id for copy_id, book_id in copies.items() if copy_id not in held)
+    Book.adjust_available_counts(freed)
+    # A copy going straight to a hold leaves the counters alone but changes what the book shows.
+    Book.touch({copies[copy_id] for copy_id in held} - set(freed))
+    return holds
+
+
+def _release(copy_ids, now):
+    """Make reserved copies whose hold is gone available again and offer them to the next in line."""
+    reserved = dict(
+        BookInstance.objects.select_for_update(of=('self',)).filter(
+            pk__in=copy_ids, status=BookStatus.RESERVED, hold__isnull=True
+        ).values_list('id', 'book_id')
+    )
+    if not reserved:
+        return [], set()
+    BookInstance.objects.filter(pk__in=reserved).update(status=BookStatus.AVAILABLE, updated_at=now)
+    return reserve_for_queue(reserved, now), set(reserved.values())
+
+
+def release_hold(entry):
+    """
+    Pass the copy held by a wishlist entry that is going away to the next in line.
+
+    Returns the wishlist entries that received a hold.
+    """
+    if entry.held_copy_id is None:
+        return []
+    with transaction.atomic():
+        holds, book_ids = _release([entry.held_copy_id], timezone.now())
+    book_cache.invalidate_books(book_ids)
+    return holds
+
+
+def expire_holds(batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Remove wishlist entries whose hold has expired, one batch per transaction,
+    and pass their copies on. Returns ``(expired, holds)`` where ``holds`` are
+    the entries that received a copy in their place.
+
+    Entries whose held copy was deleted keep their place in the queue; only
+    their stale expiry is cleared.
+    """
+    now = timezone.now()
+    UserWishlist.objects.filter(held_copy__isnull=True, hold_expires_at__isnull=False).update(hold_expires_at=None)
+    expired = 0
+    holds = []
+    while True:
+        with transaction.atomic():
+            batch = list(
+                UserWishlist.objects.select_for_update().filter(hold_expires_at__lte=now, held_copy__isnull=False)
+                .order_by('hold_expires_at', 'id').values_list('id', 'held_copy_id')[:batch_size]
+            )
+            if not batch:
+                break
+            entry_ids = [entry_id for entry_id, _ in batch]
+            # Clear the holds first so the deletion does not release them a second time.
+            UserWishlist.objects.filter(pk__in=entry_ids).update(held_copy=None, hold_expires_at=None)
+            UserWishlist.objects.filter(pk__in=entry_ids).delete()
+            new_holds, book_ids = _release([copy_id for _, copy_id in batch if copy_id], now)
+            holds.extend(new_holds)
+        book_cache.invalidate_books(book_ids)
+        expired += len(batch)
+        if len(batch) < batch_size:
+            break
+    return expired, holds
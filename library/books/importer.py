@@ -0,0 +1,277 @@
+"""
+Set-based book import.
+
+Rows are validated one by one with ``BookImportSerializer``, which makes no
+queries, so every row keeps its own error report. The valid rows of a chunk
+are then written with a fixed number of statements whatever the chunk size:
+existing books are read by ``library_id`` in one query, new books are bulk
+inserted and existing ones bulk updated, missing authors (see
+``books.authors``) and the author links are bulk inserted, and books without
+a copy get their first ``BookInstance`` and ``BookInstanceHistory`` rows in
+two more inserts. Bulk writes bypass the
+model signals, so the copy counters, search indexes and caches are
+maintained here.
+
+CSV files are read one chunk at a time by ``read_chunks``, so memory use is
+bounded by the chunk size rather than the file size. ``validate_chunk`` then
+checks ISBNs, library IDs, languages and duplicate keys with column
+operations and sets the failing rows aside, so only clean rows reach the
+database.
+"""
+import numpy as np
+import pandas as pd
+from django.db import DatabaseError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.text import slugify
+import logging
+
+from . import signals
+from .authors import AuthorResolver
+from .models import Book, BookInstance, BookInstanceHistory, BookStatus
+from .serializers import BookImportSerializer, resolve_language
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 500
+REQUIRED_COLUMNS = ['id', 'authors', 'publication year', 'title', 'language']
+# CSV headers that differ from the model field names
+COLUMN_NAMES = {"id": "library_id", "publication year": "publication_year"}
+
+
+def clean_chunk(chunk):
+    """
+    Check the header of a chunk of a CSV file and normalize its values.
+
+    Returns ``(chunk, dropped)``, where ``dropped`` is the number of rows left
+    out for missing an ISBN or title.
+    """
+    chunk.columns = [str(name).strip().lower() for name in chunk.columns]
+    if not all(field in chunk.columns for field in REQUIRED_COLUMNS):
+        raise ValueError(f'CSV must contain the following fields: {", ".join(REQUIRED_COLUMNS)}')
+    chunk = chunk.rename(columns=COLUMN_NAMES)
+
+    cleaned = chunk.dropna(subset=["isbn", "title"]).copy()
+    cleaned["library_id"] = cleaned["library_id"].str.strip().str.zfill(10)
+    cleaned["isbn"] = cleaned["isbn"].str.replace(r'[\s-]', '', regex=True).str.upper()
+    cleaned["language"] = cleaned["language"].str.lower().str.strip()
+    cleaned["authors"] = cleaned["authors"].fillna("Unknown")
+    return cleaned, len(chunk) - len(cleaned)
+
+
+def read_chunks(f, chunksize=IMPORT_CHUNK_SIZE):
+    """
+    Yield ``(chunk, dropped)`` for each chunk of ``chunksize`` rows of an open
+    CSV file, cleaned by ``clean_chunk``. Only one chunk is held in memory at
+    a time and the row index keeps counting across chunks.
+    """
+    # Read every column as text so values such as ISBNs keep their leading zeros
+    with pd.read_csv(f, chunksize=chunksize, dtype=str) as reader:
+        for chunk in reader:
+            yield clean_chunk(chunk)
+
+
+def _digits(values, width):
+    """Turn equal-length digit strings into a ``(len(values), width)`` array, reading X as 10."""
+    codes = np.frombuffer(''.join(values).encode('ascii'), dtype=np.uint8).reshape(-1, width).astype(np.int64)
+    return np.where(codes == ord('X'), 10, codes - ord('0'))
+
+
+ISBN10_WEIGHTS = np.arange(10, 0, -1)
+ISBN13_WEIGHTS = np.array([1, 3] * 6 + [1])
+
+
+def normalize_isbns(isbns):
+    """
+    Check the ISBN-10 and ISBN-13 checksums of a Series of ISBNs and convert the
+    valid ISBN-10s to ISBN-13. Returns ``(normalized, problems)``, where
+    ``problems`` holds an error message for each invalid ISBN and None otherwise.
+    """
+    normalized = isbns.copy()
+    problems = pd.Series(None, index=isbns.index, dtype=object)
+    # ASCII digits only: \d also matches other scripts' digits, which _digits cannot read.
+    is10 = isbns.str.fullmatch(r'[0-9]{9}[0-9X]')
+    is13 = isbns.str.fullmatch(r'[0-9]{13}')
+    problems[~(is10 | is13)] = "Invalid ISBN format."
+
+    if is10.any():
+        digits = _digits(isbns[is10], 10)
+        valid = (digits @ ISBN10_WEIGHTS) % 11 == 0
+        problems[isbns[is10].index[~valid]] = "Invalid ISBN checksum."
+        # 978 prefix, the first nine digits and a new check digit
+        body = np.hstack([np.tile([9, 7, 8], (len(digits), 1)), digits[:, :9]])
+        check = (10 - (body @ ISBN13_WEIGHTS[:12]) % 10) % 10
+        normalized[is10] = ['978' + isbn[:9] + str(digit) for isbn, digit in zip(isbns[is10], check)]
+    if is13.any():
+        valid = (_digits(isbns[is13], 13) @ ISBN13_WEIGHTS) % 10 == 0
+        problems[isbns[is13].index[~valid]] = "Invalid ISBN checksum."
+    return normalized, problems
+
+
+def _map_languages(codes):
+    """Resolve each distinct language code once. Returns ``(names, problems)`` Series."""
+    names, problems = {}, {}
+    for code in codes.dropna().unique():
+        try:
+            names[code] = resolve_language(code)
+        except serializers.ValidationError as e:
+            problems[code] = str(e.detail[0])
+    return codes.map(names).fillna('Unknown'), codes.map(problems)
+
+
+def validate_chunk(chunk):
+    """
+    Check a chunk cleaned by ``clean_chunk`` with column operations before any
+    database work: ISBN checksums (normalizing ISBN-10 to ISBN-13), library ID
+    format, language codes, and library IDs and ISBNs that repeat earlier in
+    the chunk. Repeats of earlier chunks are already in the database by the
+    time this chunk is written, and ``import_rows`` handles them like any
+    existing book.
+
+    Returns ``(clean, errors)``: the valid rows, ready for ``import_rows`` with
+    ``prevalidated=True``, and ``{"row": ..., "errors": {field: [...]}}`` for
+    the others.
+    """
+    chunk = chunk.copy()
+    rows = pd.Series(chunk.index + 1, index=chunk.index)
+    problems = {}
+    problems['library_id'] = pd.Series(None, index=chunk.index, dtype=object).mask(
+        ~chunk['library_id'].str.fullmatch(r'\w{10}', na=False), "Invalid Library ID format."
+    )
+    chunk['isbn'], problems['isbn'] = normalize_isbns(chunk['isbn'])
+    chunk['language'], problems['language'] = _map_languages(chunk['language'])
+
+    # Of rows otherwise valid, only the first with a given key is imported.
+    valid = pd.concat(problems, axis=1).isna().all(axis=1)
+    for field in ('library_id', 'isbn'):
+        first = rows[valid].groupby(chunk.loc[valid, field]).transform('min')
+        repeated = first != rows[valid]
+        problems[field] = problems[field].mask(
+            repeated.reindex(chunk.index, fill_value=False),
+            "Duplicate of row " + first.astype(str).reindex(chunk.index, fill_value='') + "."
+        )
+        valid &= ~repeated.reindex(chunk.index, fill_value=False)
+
+    found = pd.concat(problems, axis=1)
+    errors = [
+        {"row": int(row), "errors": {field: [message] for field, message in messages.items() if pd.notna(message)}}
+        for row, messages in zip(rows[~valid], found[~valid].to_dict('records'))
+    ]
+    return chunk[valid], errors
+
+
+def _validate(rows, errors, context):
+    """
+    Validate rows and group them by ``library_id``. A later row for the same
+    book overrides the fields of an earlier one and adds its authors.
+    """
+    books = {}
+    for number, row in rows:
+        serializer = BookImportSerializer(data=row, context=context)
+        if not serializer.is_valid():
+            logger.error(f"Row {number} is invalid: {serializer.errors}")
+            errors.append({"row": number, "errors": serializer.errors})
+            continue
+        data = dict(serializer.validated_data)
+        names = [name.strip() for name in data.pop('authors', '').split(',') if name.strip()]
+        entry = books.setdefault(data['library_id'], {'rows': [], 'authors': []})
+        entry['rows'].append(number)
+        entry['data'] = data
+        entry['authors'] += [name for name in names if name not in entry['authors']]
+    return books
+
+
+def _reject(entry, errors, reason):
+    for number in entry['rows']:
+        errors.append({"row": number, "errors": reason})
+
+
+def _write(books, errors, now, authors):
+    """Write validated books in the current transaction. Returns the ids of the books written."""
+    isbns = [entry['data']['isbn'] for entry in books.values()]
+    found = list(Book.objects.filter(Q(library_id__in=books) | Q(isbn__in=isbns)))
+    existing = {book.library_id: book for book in found if book.library_id in books}
+
+    # An ISBN belongs to the book already holding it, or to the first row in the chunk claiming it.
+    owners = {book.isbn: book.library_id for book in found}
+    for library_id, entry in list(books.items()):
+        if owners.setdefault(entry['data']['isbn'], library_id) != library_id:
+            _reject(entry, errors, {"isbn": ["book with this ISBN already exists."]})
+            del books[library_id]
+
+    new, updated, fields = [], [], set()
+    for library_id, entry in books.items():
+        book = existing.get(library_id)
+        if book is None:
+            # The first copy is added below, so its counters start at one.
+            book = Book(**entry['data'], copy_count=1, available_count=1)
+            book.slug = slugify(f"{book.title} {book.isbn}")
+            new.append(book)
+        else:
+            for key, value in entry['data'].items():
+                setattr(book, key, value)
+            book.updated_at = now
+            updated.append(book)
+            fields.update(entry['data'])
+        entry['book'] = book
+    if updated:
+        logger.warning(f"Updating {len(updated)} books that already exist.")
+
+    Book.objects.bulk_create(new)
+    if updated:
+        Book.objects.bulk_update(updated, sorted(fields - {'library_id'}) + ['updated_at'])
+
+    author_ids = authors.resolve({name for entry in books.values() for name in entry['authors']})
+    links = {(entry['book'].pk, author_ids[name]) for entry in books.values() for name in entry['authors']}
+    Book.authors.through.objects.bulk_create([
+        Book.authors.through(book_id=book_id, author_id=author_id) for book_id, author_id in sorted(links)
+    ], ignore_conflicts=True)
+
+    stocked = set(
+        BookInstance.objects.filter(book__in=updated).values_list('book_id', flat=True).distinct()
+    ) if updated else set()
+    unstocked = [book for book in updated if book.pk not in stocked]
+    copies = BookInstance.objects.bulk_create([
+        BookInstance(book=book, status=BookStatus.AVAILABLE) for book in new + unstocked
+    ])
+    BookInstanceHistory.objects.bulk_create([
+        BookInstanceHistory(book_instance=copy, status=BookStatus.AVAILABLE) for copy in copies
+    ])
+    if unstocked:
+        Book.objects.filter(pk__in=[book.pk for book in unstocked]).update(
+            copy_count=F('copy_count') + 1, available_count=F('available_count') + 1, updated_at=now
+        )
+    return [entry['book'].pk for entry in books.values()]
+
+
+def import_rows(rows, prevalidated=False, authors=None):
+    """
+    Import a chunk of ``(row_number, row)`` pairs, where each row is a dict of
+    ``BookImportSerializer`` fields, in one transaction. ``prevalidated`` rows
+    come from ``validate_chunk`` and skip the per-row checks it already made.
+    Pass the same ``authors`` resolver for every chunk of a file so authors
+    seen in earlier chunks are not looked up again. The autocomplete index is
+    not refreshed here; call ``autocomplete.index.invalidate()`` once the
+    whole import is done.
+
+    Returns ``(imported, errors)``: the number of rows imported and a list of
+    ``{"row": row_number, "errors": ...}`` for the rows that were not. A
+    database error rejects the whole chunk.
+    """
+    errors = []
+    books = _validate(rows, errors, {'prevalidated': prevalidated})
+    book_ids = []
+    if books:
+        try:
+            with transaction.atomic():
+                book_ids = _write(books, errors, timezone.now(), authors or AuthorResolver())
+        except DatabaseError as e:
+            logger.error(f"Error importing a chunk of {len(rows)} rows: {e}")
+            for entry in books.values():
+                _reject(entry, errors, str(e))
+            books = {}
+    if book_ids:
+        signals.books_changed(book_ids)
+    errors.sort(key=lambda error: error["row"])
+    return sum(len(entry['rows']) for entry in books.values()), errors
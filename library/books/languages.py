@@ -0,0 +1,64 @@
+"""
+Language lookup for book validation and the CSV import.
+
+One dictionary maps ISO 639 codes, BCP 47 tags and language names to a
+language name. Keys are case folded, with ``_`` read as ``-``. The dictionary
+is built once, on first use. ISO 639 codes take precedence over BCP 47 tags,
+and both over names, as in the order the lookups used to be tried. A key that
+maps to several languages within one of these groups is ambiguous and
+resolves to a tuple of the candidate names.
+"""
+import threading
+import bcp47
+import iso639
+
+ISO639_PARTS = ['part1', 'part2b', 'part2t', 'part3']
+UNKNOWN = 'Unknown'
+
+_table = None
+_lock = threading.Lock()
+
+
+def normalize(value):
+    """The lookup key for a code or name."""
+    return str(value).strip().replace('_', '-').casefold()
+
+
+def _add_group(table, pairs):
+    """Add ``(key, name)`` pairs to the table, leaving keys taken by an earlier group alone."""
+    group = {}
+    for key, name in pairs:
+        if key:
+            group.setdefault(normalize(key), set()).add(name)
+    for key, names in group.items():
+        if key not in table:
+            table[key] = names.pop() if len(names) == 1 else tuple(sorted(names))
+
+
+def _build():
+    table = {}
+    _add_group(table, (
+        (getattr(language, part), language.name) for language in iso639.languages for part in ISO639_PARTS
+    ))
+    _add_group(table, ((tag, name) for name, tag in bcp47.languages.items()))
+    names = [language.name for language in iso639.languages] + list(bcp47.languages)
+    _add_group(table, ((name, name) for name in names))
+    return table
+
+
+def lookup_table():
+    """The lookup dictionary, built on the first call."""
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table = _build()
+    return _table
+
+
+def lookup(value):
+    """
+    Return the name of the language with the given code or name, a tuple of
+    candidate names if it is ambiguous, or 'Unknown'.
+    """
+    return lookup_table().get(normalize(value), UNKNOWN)
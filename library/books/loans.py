@@ -0,0 +1,299 @@
+"""
+Borrow and return as single conditional state transitions.
+
+Each transition is an ``UPDATE ... WHERE id = ? AND status = ?`` whose row
+count says whether it won, committed in one transaction with the history
+rows and the copy's ``current_loan`` pointer. Two concurrent borrows of the same copy cannot both succeed, and no row
+is read or locked beforehand. ``QuerySet.update`` bypasses the BookInstance
+signals, so the copy counters and the response cache are maintained here.
+
+Returned copies are first offered to the book's hold queue (``books.holds``);
+a reserved copy can only be borrowed by the user holding it.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Case, Exists, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import cache as book_cache
+from .holds import reserve_for_queue
+from .models import Book, BookInstance, BookInstanceHistory, BookStatus
+from users.models import UserWishlist
+
+logger = logging.getLogger(__name__)
+
+LOAN_PERIOD = timedelta(days=14)
+OPEN_LOAN_CONSTRAINT = 'one_open_loan_per_instance'
+# How often a batch is retried when a copy changes between reading and claiming it.
+BATCH_ATTEMPTS = 3
+
+
+class _BatchConflict(Exception):
+    """A copy in a batch changed status after it was read."""
+
+
+def borrow_copy(book_instance, user):
+    """
+    Borrow an available copy, or one held for ``user``, for ``user``.
+
+    Returns the open loan (a BookInstanceHistory row), or None if the copy was
+    not available.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = BookInstance.objects.filter(pk=book_instance.pk, status=BookStatus.AVAILABLE).update(
+            status=BookStatus.BORROWED, updated_at=now
+        )
+        if claimed:
+            Book.adjust_copy_counts(book_instance.book_id, available=-1)
+        else:
+            claimed = BookInstance.objects.filter(
+                pk=book_instance.pk, status=BookStatus.RESERVED, hold__user=user
+            ).update(status=BookStatus.BORROWED, updated_at=now)
+            if not claimed:
+                return None
+            UserWishlist.objects.filter(held_copy_id=book_instance.pk).update(held_copy=None, hold_expires_at=None)
+            # Reserved to borrowed leaves the counters alone but changes what the book shows.
+            Book.touch([book_instance.book_id])
+        loan = BookInstanceHistory.objects.create(
+            book_instance_id=book_instance.pk,
+            status=BookStatus.BORROWED,
+            user=user,
+            borrowed_date=now,
+            due_date=now + LOAN_PERIOD,
+            is_returned=False
+        )
+        BookInstance.objects.filter(pk=book_instance.pk).update(current_loan=loan)
+
+    book_cache.invalidate_books([book_instance.book_id])
+    book_instance.status = book_instance._loaded_status = BookStatus.BORROWED
+    book_instance.current_loan = loan
+    return loan
+
+
+def borrow_any_copy(book, user):
+    """
+    Borrow whichever available copy of ``book``, or copy held for ``user``,
+    has the lowest id.
+
+    Losing the claim to a concurrent borrower moves on to the next free copy,
+    so no rows or tables are locked while choosing. Returns ``(copy, loan)``,
+    or ``(None, None)`` if no copy is available.
+    """
+    last_tried = 0
+    while True:
+        candidate = BookInstance.objects.filter(
+            Q(status=BookStatus.AVAILABLE) | Q(status=BookStatus.RESERVED, hold__user=user),
+            book_id=book.pk,
+            id__gt=last_tried
+        ).order_by('id').first()
+        if candidate is None:
+            return None, None
+        loan = borrow_copy(candidate, user)
+        if loan is not None:
+            return candidate, loan
+        last_tried = candidate.pk
+
+
+def return_copy(book_instance, user):
+    """
+    Return a borrowed copy, closing its open loan.
+
+    The copy is held for the head of the book's hold queue if anyone is
+    waiting. Returns ``(returned, hold)``: ``returned`` is False if the copy was
+    not borrowed and ``hold`` is the wishlist entry now holding it, if any.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        released = BookInstance.objects.filter(pk=book_instance.pk, status=BookStatus.BORROWED).update(
+            status=BookStatus.AVAILABLE, current_loan=None, updated_at=now
+        )
+        if not released:
+            return False, None
+        BookInstanceHistory.objects.filter(book_instance_id=book_instance.pk, is_returned=False).update(
+            is_returned=True, returned_date=now
+        )
+        BookInstanceHistory.objects.create(
+            book_instance_id=book_instance.pk,
+            status=BookStatus.AVAILABLE,
+            user=user,
+            returned_date=now,
+            is_returned=True
+        )
+        holds = reserve_for_queue({book_instance.pk: book_instance.book_id}, now)
+
+    book_cache.invalidate_books([book_instance.book_id])
+    hold = holds[0] if holds else None
+    book_instance.status = book_instance._loaded_status = BookStatus.RESERVED if hold else BookStatus.AVAILABLE
+    book_instance.current_loan = None
+    return True, hold
+
+
+def _run_batch(transition, instance_ids, user):
+    for attempt in range(1, BATCH_ATTEMPTS + 1):
+        try:
+            return transition(list(set(instance_ids)), user)
+        except _BatchConflict:
+            if attempt == BATCH_ATTEMPTS:
+                raise
+
+
+def _flip_statuses(ids, from_statuses, to_status, now, **fields):
+    """Move the copies, all in one of ``from_statuses``, to ``to_status`` with one update."""
+    if ids:
+        flipped = BookInstance.objects.filter(pk__in=ids, status__in=from_statuses).update(
+            status=to_status, updated_at=now, **fields
+        )
+        if flipped != len(ids):
+            raise _BatchConflict()
+
+
+def _lock_copies(instance_ids):
+    return {
+        pk: (book_id, current)
+        for pk, book_id, current in BookInstance.objects.select_for_update().filter(
+            id__in=instance_ids
+        ).values_list('id', 'book_id', 'status')
+    }
+
+
+def _borrow_batch(instance_ids, user):
+    now = timezone.now()
+    with transaction.atomic():
+        copies = _lock_copies(instance_ids)
+        available = [pk for pk, (_, current) in copies.items() if current == BookStatus.AVAILABLE]
+        held = []
+        if any(current == BookStatus.RESERVED for _, current in copies.values()):
+            held = list(
+                UserWishlist.objects.filter(user=user, held_copy_id__in=copies).values_list('held_copy_id', flat=True)
+            )
+        claimed = available + held
+        _flip_statuses(claimed, [BookStatus.AVAILABLE, BookStatus.RESERVED], BookStatus.BORROWED, now)
+        if held:
+            UserWishlist.objects.filter(held_copy_id__in=held).update(held_copy=None, hold_expires_at=None)
+        loans = BookInstanceHistory.objects.bulk_create([
+            BookInstanceHistory(
+                book_instance_id=pk,
+                status=BookStatus.BORROWED,
+                user=user,
+                borrowed_date=now,
+                due_date=now + LOAN_PERIOD,
+                is_returned=False
+            )
+            for pk in claimed
+        ])
+        if loans:
+            BookInstance.objects.filter(pk__in=claimed).update(
+                current_loan=Case(*[When(pk=loan.book_instance_id, then=loan.pk) for loan in loans])
+            )
+        per_book = Counter(copies[pk][0] for pk in available)
+        Book.adjust_available_counts({book_id: -count for book_id, count in per_book.items()})
+        # Books whose only change was reserved to borrowed
+        Book.touch({copies[pk][0] for pk in held} - set(per_book))
+
+    if claimed:
+        book_cache.invalidate_books({copies[pk][0] for pk in claimed})
+    outcomes = {pk: ('borrowed' if pk in claimed else 'unavailable') for pk in copies}
+    return outcomes, {pk: copies[pk][0] for pk in claimed}, now + LOAN_PERIOD
+
+
+def borrow_copies(instance_ids, user):
+    """
+    Borrow several copies for ``user`` in one transaction, including copies
+    held for them.
+
+    The copies are read with one query, flipped with one update and their loans
+    inserted with one bulk insert. Returns ``(outcomes, borrowed, due_date)``:
+    ``outcomes`` maps every id to ``'borrowed'``, ``'unavailable'`` or
+    ``'not_found'`` and ``borrowed`` maps each borrowed copy to its book id.
+    """
+    outcomes, borrowed, due_date = _run_batch(_borrow_batch, instance_ids, user)
+    return {pk: outcomes.get(pk, 'not_found') for pk in instance_ids}, borrowed, due_date
+
+
+def _return_batch(instance_ids, user):
+    now = timezone.now()
+    with transaction.atomic():
+        copies = _lock_copies(instance_ids)
+        released = [pk for pk, (_, current) in copies.items() if current == BookStatus.BORROWED]
+        _flip_statuses(released, [BookStatus.BORROWED], BookStatus.AVAILABLE, now, current_loan=None)
+        BookInstanceHistory.objects.filter(book_instance_id__in=released, is_returned=False).update(
+            is_returned=True, returned_date=now
+        )
+        BookInstanceHistory.objects.bulk_create([
+            BookInstanceHistory(
+                book_instance_id=pk,
+                status=BookStatus.AVAILABLE,
+                user=user,
+                returned_date=now,
+                is_returned=True
+            )
+            for pk in released
+        ])
+        holds = reserve_for_queue({pk: copies[pk][0] for pk in released}, now)
+
+    if released:
+        book_cache.invalidate_books({copies[pk][0] for pk in released})
+    outcomes = {pk: ('returned' if pk in released else 'not_borrowed') for pk in copies}
+    return outcomes, holds
+
+
+def return_copies(instance_ids, user):
+    """
+    Return several copies in one transaction, closing their open loans and
+    holding copies for anyone waiting.
+
+    Returns ``(outcomes, holds)``: ``outcomes`` maps every id to
+    ``'returned'``, ``'not_borrowed'`` or ``'not_found'`` and ``holds`` lists
+    the wishlist entries that now hold one of the copies.
+    """
+    outcomes, holds = _run_batch(_return_batch, instance_ids, user)
+    return {pk: outcomes.get(pk, 'not_found') for pk in instance_ids}, holds
+
+
+def later_history():
+    """History rows of the outer row's copy written after it, oldest first."""
+    return BookInstanceHistory.objects.filter(
+        book_instance_id=OuterRef('book_instance_id'), id__gt=OuterRef('pk')
+    ).order_by('id')
+
+
+def close_superseded_loans(using=DEFAULT_DB_ALIAS):
+    """
+    Close open loans followed by a later history row of the same copy.
+
+    Borrowing used to leave its row open when the copy came back, so older
+    data holds open loans that were returned long ago. Each is closed with the
+    return date of the next row, or its borrowed date if that row is a borrow.
+    Returns the number of loans closed.
+    """
+    later = later_history()
+    return BookInstanceHistory.objects.using(using).filter(is_returned=False).filter(Exists(later)).update(
+        is_returned=True,
+        returned_date=Coalesce(
+            Subquery(later.values('returned_date')[:1]), Subquery(later.values('borrowed_date')[:1])
+        )
+    )
+
+
+def ensure_open_loan_constraint(using=DEFAULT_DB_ALIAS):
+    """
+    Add the one-open-loan-per-copy constraint to a history table created
+    before it existed, closing superseded loans first so existing data fits.
+    """
+    connection = connections[using]
+    table = BookInstanceHistory._meta.db_table
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            return
+        if OPEN_LOAN_CONSTRAINT in connection.introspection.get_constraints(cursor, table):
+            return
+    constraint = next(c for c in BookInstanceHistory._meta.constraints if c.name == OPEN_LOAN_CONSTRAINT)
+    # The schema editor runs in its own transaction, so the backfill and the constraint commit together.
+    with connection.schema_editor() as editor:
+        closed = close_superseded_loans(using)
+        editor.add_constraint(BookInstanceHistory, constraint)
+    logger.info(f"Closed {closed} superseded loans and added {OPEN_LOAN_CONSTRAINT}")
@@ -0,0 +1,30 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from books.archive import ARCHIVE_BATCH_SIZE, archive_history
+
+
+class Command(BaseCommand):
+    help = "Move closed loan history older than a given age into the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'HISTORY_ARCHIVE_AFTER_DAYS', 365),
+            help="Archive history closed more than this many days ago."
+        )
+        parser.add_argument(
+            '--compact', action='store_true', default=getattr(settings, 'HISTORY_ARCHIVE_COMPACT', False),
+            help="Keep one record per loan instead of separate borrow and return rows."
+        )
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help="Rows to move per transaction.")
+        parser.add_argument('--database', default='default', help="Database to archive.")
+
+    def handle(self, *args, **options):
+        moved, archived = archive_history(
+            older_than=timedelta(days=options['days']),
+            compact=options['compact'],
+            batch_size=options['batch_size'],
+            using=options['database'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} history rows into {archived} archive records."))
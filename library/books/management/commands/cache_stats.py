@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from books import cache
+
+
+class Command(BaseCommand):
+    help = "Show the hit/miss counters of the book response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        stats = cache.get_stats()
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} hit_ratio={stats['hit_ratio']:.2%}"
+        )
+        if options['reset']:
+            cache.reset_stats()
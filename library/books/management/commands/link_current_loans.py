@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Subquery
+
+from books.loans import later_history
+from books.models import BookInstance, BookInstanceHistory, BookStatus
+
+
+class Command(BaseCommand):
+    help = "Point borrowed copies that have no current_loan at their open loan, e.g. after upgrading."
+
+    def handle(self, *args, **options):
+        # Open rows followed by later history were returned before loans were closed on return.
+        open_loan = BookInstanceHistory.objects.filter(
+            book_instance=OuterRef('pk'), is_returned=False
+        ).exclude(Exists(later_history())).order_by().values('pk')[:1]
+        linked = BookInstance.objects.filter(
+            status=BookStatus.BORROWED, current_loan__isnull=True
+        ).update(current_loan=Subquery(open_loan))
+        self.stdout.write(self.style.SUCCESS(f"Linked {linked} borrowed copies to their open loans."))
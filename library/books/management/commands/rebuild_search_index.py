@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from books import fuzzy
+from books.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text and fuzzy search indexes over book titles and author names."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database alias to rebuild the index on.")
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index(options['database'])
+        fuzzy.rebuild_index(options['database'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} books."))
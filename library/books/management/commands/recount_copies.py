@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from books.models import Book, BookInstance, BookStatus
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored copy_count/available_count of every book and repair drifted ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of books to check per batch.")
+        parser.add_argument('--dry-run', action='store_true', help="Report drifted books without fixing them.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        instances = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+        actual_copies = Coalesce(Subquery(instances.annotate(c=Count('id')).values('c')), 0)
+        actual_available = Coalesce(
+            Subquery(instances.filter(status=BookStatus.AVAILABLE).annotate(c=Count('id')).values('c')), 0
+        )
+
+        repaired = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Book.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]
+
+            drifted = Book.objects.filter(id__in=batch).annotate(
+                actual_copies=actual_copies, actual_available=actual_available
+            ).filter(~Q(copy_count=F('actual_copies')) | ~Q(available_count=F('actual_available')))
+            drifted_ids = list(drifted.values_list('id', flat=True))
+            if not drifted_ids:
+                continue
+            repaired += len(drifted_ids)
+            if options['dry_run']:
+                continue
+            with transaction.atomic():
+                Book.objects.filter(id__in=drifted_ids).update(
+                    copy_count=actual_copies, available_count=actual_available
+                )
+
+        verb = "Found" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {repaired} books with drifted copy counters."))
@@ -0,0 +1,95 @@
+import hashlib
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import cache as book_cache
+
+
+class ConditionalGetMixin:
+    """
+    Answer conditional list and retrieve requests with ``304 Not Modified``.
+
+    The validator is the latest ``updated_at`` of the filtered queryset (or the
+    single object) plus its row count, so deletions change it as well. Both are
+    read with one aggregate query before anything is serialized. Views whose
+    writes bump a cache version can return a key from
+    ``validator_cache_key`` to keep the validators in the cache, so repeated
+    requests skip the aggregate.
+    """
+    validator_field = 'updated_at'
+
+    def validator_cache_key(self, request, pk=None):
+        """Cache key for the validators of this request, or None to compute them every time."""
+        return None
+
+    def _cached_validators(self, request, get_queryset, pk=None):
+        key = self.validator_cache_key(request, pk)
+        if key is None:
+            return self._validators(get_queryset())
+        cache = book_cache.get_cache()
+        validators = cache.get(key)
+        if validators is None:
+            validators = self._validators(get_queryset())
+            cache.set(key, validators, timeout=getattr(settings, 'BOOK_CACHE_TIMEOUT', 300))
+        return validators
+
+    def _validators(self, queryset):
+        values = queryset.prefetch_related(None).order_by().aggregate(
+            last_modified=Max(self.validator_field), count=Count('pk')
+        )
+        if values['last_modified'] is None:
+            return None, None
+        digest = hashlib.md5(f"{values['last_modified'].isoformat()}:{values['count']}".encode('utf-8')).hexdigest()
+        return quote_etag(digest), values['last_modified'].timestamp()
+
+    def _conditional(self, request, get_queryset, render, pk=None):
+        try:
+            etag, last_modified = self._cached_validators(request, get_queryset, pk)
+        except (TypeError, ValueError, ValidationError):
+            # A malformed lookup value; let the view produce its usual 404.
+            return render()
+        if etag is not None:
+            not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+        response = render()
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(
+            request,
+            lambda: self.filter_queryset(self.get_queryset()),
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self._conditional(
+            request,
+            lambda: self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]}),
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+            pk=kwargs[lookup_url_kwarg]
+        )
+
+
+class CachedResponseMixin:
+    """Serve list and retrieve responses through ``books.cache``."""
+
+    def list(self, request, *args, **kwargs):
+        return book_cache.cached_response(
+            book_cache.catalog_key(request),
+            lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return book_cache.cached_response(
+            book_cache.book_key(request, kwargs[lookup_url_kwarg]),
+            lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs)
+        )
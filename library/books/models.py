@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Lower
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.utils.text import slugify
@@ -14,13 +16,26 @@ class Author(models.Model):
         verbose_name_plural = _('authors')
         default_related_name = 'authors'
         db_table = 'authors'
+        indexes = [
+            # Case-insensitive surname lookups when resolving imported authors
+            models.Index(Lower('surname'), name='author_surname_lower_idx'),
+        ]
 
     given_names = models.CharField(_('given names'), max_length=100)
     surname = models.CharField(_('surname'), max_length=100)
     slug = models.SlugField(_('slug'), max_length=255, unique=True, blank=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
     
     def __str__(self):
         return f"{self.given_names} {self.surname}"
+
+    @staticmethod
+    def split_name(name):
+        """Split a full name into ``(given_names, surname)`` at the last space."""
+        parts = name.strip().rsplit(' ', 1)
+        if len(parts) == 2:
+            return parts[0].strip(), parts[1].strip()
+        return "", parts[0].strip()
     
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -37,6 +52,8 @@ class Book(models.Model):
             models.Index(fields=['title']),
             models.Index(fields=['isbn']),
             models.Index(fields=['amazon_id']),
+            models.Index(fields=['available_count', 'title']),
+            models.Index(fields=['updated_at']),
         ]
     
     # Book details
@@ -55,13 +72,49 @@ class Book(models.Model):
     updated_at = models.DateTimeField(_('updated at'), auto_now=True)
     slug = models.SlugField(_('slug'), max_length=255, unique=True, blank=True)
 
+    # Denormalized counters, maintained by the BookInstance signals in books.signals.
+    # Repair them with ``manage.py recount_copies``.
+    copy_count = models.PositiveIntegerField(_('copies'), default=0, editable=False)
+    available_count = models.PositiveIntegerField(_('available copies'), default=0, editable=False)
+    COUNTER_FIELDS = ('copy_count', 'available_count')
+
     @property
     def total_copies(self):
-        return self.book_instances.count()
+        return self.copy_count
 
     @property
     def available_copies(self):
-        return self.book_instances.filter(status='A').count()
+        return self.available_count
+
+    @classmethod
+    def adjust_copy_counts(cls, book_id, copies=0, available=0):
+        """Atomically add to a book's stored copy counters."""
+        if copies or available:
+            cls.objects.filter(pk=book_id).update(
+                copy_count=F('copy_count') + copies,
+                available_count=F('available_count') + available,
+                updated_at=timezone.now()
+            )
+
+    @classmethod
+    def adjust_available_counts(cls, deltas):
+        """Add ``{book_id: delta}`` to several books' available counters in one update."""
+        deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+        if deltas:
+            cls.objects.filter(pk__in=deltas).update(
+                available_count=F('available_count') + Case(
+                    *[When(pk=book_id, then=Value(delta)) for book_id, delta in deltas.items()],
+                    default=Value(0)
+                ),
+                updated_at=timezone.now()
+            )
+
+    @classmethod
+    def touch(cls, book_ids):
+        """Mark books as modified when related data they display has changed."""
+        book_ids = list(book_ids)
+        if book_ids:
+            cls.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
 
     def __str__(self):
         return f"{self.title}"
@@ -69,6 +122,13 @@ class Book(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(f"{self.title} {self.isbn}")
+        if not self._state.adding and not kwargs.get('force_insert'):
+            # The counters of an existing book are only changed with F() updates,
+            # so a copy loaded earlier must not write its stale values back.
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name not in self.COUNTER_FIELDS]
         super().save(*args, **kwargs)
     
     def get_absolute_url(self):
@@ -87,6 +147,9 @@ class BookInstance(models.Model):
         verbose_name_plural = _('book instances')
         default_related_name = 'book_instances'
         db_table = 'book_instances'
+        indexes = [
+            models.Index(fields=['book', 'status']),
+        ]
     
     book = models.ForeignKey('books.Book', on_delete=models.CASCADE)
     status = models.CharField(
@@ -95,10 +158,27 @@ class BookInstance(models.Model):
         choices=BookStatus.choices,
         default=BookStatus.AVAILABLE
     )
+    # The open loan while borrowed, maintained by books.loans
+    current_loan = models.OneToOneField(
+        'books.BookInstanceHistory',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        verbose_name=_('current loan')
+    )
     # Metadata
     created_at = models.DateTimeField(_('created at'), auto_now_add=True)
     updated_at = models.DateTimeField(_('updated at'), auto_now=True)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so saves can tell whether availability changed.
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
     @property
     def is_available(self):
         return self.status == BookStatus.AVAILABLE
@@ -115,6 +195,25 @@ class BookInstanceHistory(models.Model):
         ordering = [
             models.F('borrowed_date').desc(nulls_last=True)
         ]
+        constraints = [
+            # At most one open loan per copy; see books.loans.
+            models.UniqueConstraint(
+                fields=['book_instance'],
+                condition=models.Q(is_returned=False),
+                name='one_open_loan_per_instance'
+            ),
+        ]
+        indexes = [
+            # A user's loan history, newest first, and their open loans; see users.views.CurrentUserLoansView.
+            models.Index(fields=['user', 'borrowed_date']),
+            models.Index(fields=['user', 'is_returned']),
+            # Open loans still owed a reminder, by due date; see books.tasks.send_overdue_reminders_task.
+            models.Index(
+                fields=['due_date', 'id'],
+                condition=models.Q(is_returned=False, reminder_sent_at__isnull=True),
+                name='overdue_reminder_idx'
+            ),
+        ]
         
     book_instance = models.ForeignKey(
         'books.BookInstance',
@@ -140,6 +239,90 @@ class BookInstanceHistory(models.Model):
     due_date = models.DateTimeField(_('due date'), null=True, blank=True)
     returned_date = models.DateTimeField(_('returned date'), null=True, blank=True)
     is_returned = models.BooleanField(_('is returned'), default=True)
+    reminder_sent_at = models.DateTimeField(_('reminder sent at'), null=True, blank=True)
     
     def __str__(self):
-        return f"{self.book_instance.book.title} - {self.status}"
\ No newline at end of file
+        return f"{self.book_instance.book.title} - {self.status}"
+
+class BookInstanceHistoryArchive(models.Model):
+    """
+    Closed BookInstanceHistory rows moved out of the hot table by books.archive.
+
+    Rows keep their original id. The relations are not enforced so archived
+    history outlives deleted copies, books and users.
+    """
+    class Meta:
+        verbose_name = _('archived book instance history')
+        verbose_name_plural = _('archived book instance histories')
+        db_table = 'book_instance_history_archive'
+        indexes = [
+            models.Index(fields=['borrowed_date']),
+            models.Index(fields=['user', 'borrowed_date']),
+        ]
+
+    id = models.BigIntegerField(primary_key=True)
+    book_instance = models.ForeignKey(
+        'books.BookInstance',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+',
+        verbose_name=_('book instance')
+    )
+    # Copied from the copy at archive time, so the book is known after the copy is gone
+    book = models.ForeignKey(
+        'books.Book',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+',
+        verbose_name=_('book')
+    )
+    status = models.CharField(_('status'), max_length=2, choices=BookStatus.choices)
+    user = models.ForeignKey(
+        'users.CustomUser',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+',
+        verbose_name=_('user')
+    )
+    borrowed_date = models.DateTimeField(_('borrowed date'), null=True, blank=True)
+    due_date = models.DateTimeField(_('due date'), null=True, blank=True)
+    returned_date = models.DateTimeField(_('returned date'), null=True, blank=True)
+    archived_at = models.DateTimeField(_('archived at'))
+
+    # Only closed history is archived.
+    is_returned = True
+
+    def __str__(self):
+        return f"{self.id} - {self.status}"
+
+class SearchTerm(models.Model):
+    """A normalized word from a book title or author name, for fuzzy search."""
+    class Meta:
+        verbose_name = _('search term')
+        verbose_name_plural = _('search terms')
+        db_table = 'search_terms'
+
+    term = models.CharField(_('term'), max_length=100, unique=True)
+    gram_count = models.PositiveSmallIntegerField(_('trigram count'))
+    books = models.ManyToManyField(Book, related_name='search_terms')
+
+    def __str__(self):
+        return self.term
+
+
+class SearchTrigram(models.Model):
+    """A trigram of a SearchTerm. Fuzzy lookups go through the trigram index."""
+    class Meta:
+        verbose_name = _('search trigram')
+        verbose_name_plural = _('search trigrams')
+        db_table = 'search_trigrams'
+        unique_together = ('trigram', 'term')
+
+    trigram = models.CharField(_('trigram'), max_length=3)
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='trigrams')
+
+    def __str__(self):
+        return self.trigram
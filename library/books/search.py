@@ -0,0 +1,231 @@
+"""
+Full-text search index over book titles and author names.
+
+SQLite uses an FTS5 virtual table keyed on the book id and PostgreSQL a
+tsvector table with a GIN index. Other backends fall back to ``icontains``
+lookups. The index is kept in sync by the handlers in ``books.signals``.
+"""
+import re
+import logging
+from collections import defaultdict
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# Keep well below SQLite's limit on the number of query parameters.
+BATCH_SIZE = 500
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _terms(query):
+    """Split a free-text query into safe search terms."""
+    return TERM_RE.findall(query.lower())
+
+
+def _documents(book_ids):
+    """Return ``(book_id, title, author_names)`` for the given books."""
+    titles = dict(Book.objects.filter(id__in=book_ids).values_list('id', 'title'))
+    names = defaultdict(list)
+    rows = Book.authors.through.objects.filter(book_id__in=book_ids).values_list(
+        'book_id', 'author__given_names', 'author__surname'
+    )
+    for book_id, given_names, surname in rows:
+        names[book_id].append(f"{given_names} {surname}".strip())
+    return [(book_id, title, ' '.join(names[book_id])) for book_id, title in titles.items()]
+
+
+def _book_id_column(connection):
+    return f"{connection.ops.quote_name(Book._meta.db_table)}.{connection.ops.quote_name('id')}"
+
+
+class SQLiteSearchBackend:
+    """FTS5 virtual table, with diacritics folded so "Bronte" matches "Brontë"."""
+    table = 'book_search_fts'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def exists(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+            return cursor.fetchone() is not None
+
+    def create(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                f"USING fts5(title, authors, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    def delete(self, book_ids):
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", list(book_ids))
+
+    def write(self, documents):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, title, authors) VALUES (%s, %s, %s)",
+                documents
+            )
+
+    def search(self, queryset, terms):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        book_id = _book_id_column(self.connection)
+        # bm25() is lower-is-better and weights title matches over author matches.
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT -bm25({self.table}, 10.0, 5.0) FROM {self.table} "
+                f"WHERE {self.table} MATCH %s AND rowid = {book_id}",
+                [match],
+                output_field=FloatField()
+            )
+        )
+
+
+class PostgresSearchBackend:
+    """tsvector table with a GIN index, titles weighted above author names."""
+    table = 'book_search'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def exists(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [self.table])
+            return cursor.fetchone()[0] is not None
+
+    def create(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"book_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_document_idx ON {self.table} USING GIN (document)"
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+
+    def delete(self, book_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE book_id = ANY(%s)", [list(book_ids)])
+
+    def write(self, documents):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (book_id, document) VALUES (%s, "
+                f"setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+                f"ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document",
+                documents
+            )
+
+    def search(self, queryset, terms):
+        tsquery = ' & '.join(f"{term}:*" for term in terms)
+        book_id = _book_id_column(self.connection)
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT book_id FROM {self.table} WHERE document @@ to_tsquery('simple', %s)",
+                [tsquery]
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT ts_rank(document, to_tsquery('simple', %s)) FROM {self.table} "
+                f"WHERE book_id = {book_id}",
+                [tsquery],
+                output_field=FloatField()
+            )
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(using=DEFAULT_DB_ALIAS):
+    """Return the search backend for the given database, or None if it has none."""
+    connection = connections[using]
+    backend_class = BACKENDS.get(connection.vendor)
+    if backend_class is None:
+        return None
+    return backend_class(connection)
+
+
+def ensure_search_index(using=DEFAULT_DB_ALIAS):
+    """Create the search index if it is missing and populate it from existing books."""
+    backend = get_backend(using)
+    if backend is None or backend.exists():
+        return
+    backend.create()
+    rebuild_search_index(using)
+
+
+def rebuild_search_index(using=DEFAULT_DB_ALIAS):
+    """Drop every indexed document and re-index the whole catalog."""
+    backend = get_backend(using)
+    if backend is None:
+        return 0
+    backend.create()
+    backend.clear()
+    book_ids = list(Book.objects.using(using).values_list('id', flat=True))
+    index_books(book_ids, using)
+    logger.info(f"Rebuilt search index for {len(book_ids)} books")
+    return len(book_ids)
+
+
+def index_books(book_ids, using=DEFAULT_DB_ALIAS):
+    """(Re-)index the given books. Ids of books that no longer exist are removed."""
+    backend = get_backend(using)
+    book_ids = list(set(book_ids))
+    if backend is None or not book_ids:
+        return
+    for i in range(0, len(book_ids), BATCH_SIZE):
+        batch = book_ids[i:i + BATCH_SIZE]
+        backend.delete(batch)
+        backend.write(_documents(batch))
+
+
+def remove_books(book_ids, using=DEFAULT_DB_ALIAS):
+    """Remove the given books from the index."""
+    backend = get_backend(using)
+    book_ids = list(set(book_ids))
+    if backend is None or not book_ids:
+        return
+    for i in range(0, len(book_ids), BATCH_SIZE):
+        backend.delete(book_ids[i:i + BATCH_SIZE])
+
+
+def search_books(queryset, query, using=DEFAULT_DB_ALIAS):
+    """
+    Filter ``queryset`` to books matching ``query``, best matches first.
+
+    Every term must match the start of a word in the title or an author name.
+    Each book appears once however many of its authors match.
+    """
+    terms = _terms(query)
+    if not terms:
+        return queryset.none()
+
+    backend = get_backend(using)
+    if backend is None:
+        matching = Q()
+        for term in terms:
+            matching &= Q(title__icontains=term) | Q(authors__given_names__icontains=term) | Q(authors__surname__icontains=term)
+        return queryset.filter(id__in=Book.objects.filter(matching).values('id')).order_by('title', 'id')
+
+    return backend.search(queryset, terms).order_by('-search_rank', 'id')
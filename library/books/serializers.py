@@ -1,9 +1,8 @@
 from rest_framework import serializers
 from django.db import transaction
 import re
-import iso639
-import bcp47
 import logging
+from . import languages
 from .models import Author, Book, BookInstance, BookInstanceHistory
 
 logger = logging.getLogger(__name__)
@@ -22,8 +21,27 @@ class AuthorSerializer(serializers.ModelSerializer):
             'surname': {'required': True},
         }
 
+def resolve_language(value):
+    """
+    Return the name of the language with the given ISO 639 or BCP 47 code or
+    name, or 'Unknown'. Raises ValidationError if it matches more than one language.
+    """
+    language = languages.lookup(value)
+    if isinstance(language, tuple):
+        raise serializers.ValidationError(f"Found more than one matching language for {value}, {list(language)}. Maybe try a different code.")
+    return language
+
+def _split_param(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
 class BookSerializer(serializers.ModelSerializer):
-    """Serializer for the Book model."""
+    """
+    Serializer for the Book model.
+
+    On GET requests, ``?fields=`` selects top-level fields and ``?expand=``
+    opts into the nested ``expandable_fields``, which are left out by default.
+    """
     class Meta:
         model = Book
         fields = [
@@ -60,15 +78,35 @@ class BookSerializer(serializers.ModelSerializer):
     total_copies = serializers.SerializerMethodField(read_only=True)
     available_copies = serializers.SerializerMethodField(read_only=True)
     book_instances = serializers.SerializerMethodField(read_only=True)
+
+    expandable_fields = ['book_instances']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        selected = self.selected_fields(request.query_params)
+        for name in list(self.fields):
+            if name not in selected:
+                self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, query_params):
+        """Return the names of the fields requested with ``?fields=`` and ``?expand=``."""
+        fields = _split_param(query_params.get('fields'))
+        if not fields:
+            fields = set(cls.Meta.fields) - set(cls.expandable_fields)
+        return (fields | _split_param(query_params.get('expand'))) & set(cls.Meta.fields)
     
     def get_authors_display(self, obj):
         return (', '.join([f"{author.given_names} {author.surname}" for author in obj.authors.all()]))
     
     def get_total_copies(self, obj):
-        return obj.book_instances.count()
+        return obj.total_copies
     
     def get_available_copies(self, obj):
-        return obj.book_instances.filter(status='A').count()
+        return obj.available_copies
 
     def get_book_instances(self, obj):
         return BookInstanceSerializer(obj.book_instances.all(), many=True).data
@@ -89,25 +127,11 @@ class BookSerializer(serializers.ModelSerializer):
         return value
 
     def validate_language(self, value):
-        # Try searching for language using the ISO-639 group of language codes.
-        for part in ['part1', 'part2b', 'part2t', 'part3', 'alpha2']:
-            try:
-                return iso639.languages.get(**{part: value}).name
-            except KeyError:
-                continue
-            except ValueError:
-                break   
-        # Failing that, try searching with the IETF BCP 47 language codes.
-        matching_languages = [k for k, v in bcp47.languages.items() if v == value]
-        if len(matching_languages) == 0:
-            return 'Unknown'
-        if len(matching_languages) == 1:
-            return matching_languages[0].__str__()
-        if len(matching_languages) > 1:
-            raise serializers.ValidationError(f"Found more than one matching language for {value}, {matching_languages}. Maybe try a different code.")
+        return resolve_language(value)
     
 
 class BookImportSerializer(BookSerializer):
+    """Validates the rows of a CSV import, which ``books.importer`` then writes in bulk."""
     class Meta:
         model = Book
         fields = [
@@ -134,114 +158,57 @@ class BookImportSerializer(BookSerializer):
     # Accommodate authors format    
     authors = serializers.CharField(write_only=True)  # Accepts a CSV string
 
-    def create(self, validated_data):
-        authors_string = validated_data.pop('authors', '')
-        
-        with transaction.atomic():
-            # Get or create the book using the unique fields
-            book, created = Book.objects.get_or_create(
-                library_id=validated_data.get('library_id'),
-                defaults=validated_data
-            )
-            
-            # If the book already exists, update fields
-            if not created:
-                logger.warning(f"Book with library_id {validated_data['library_id']} already exists. Updating fields.")
-                for key, value in validated_data.items():
-                    setattr(book, key, value)
-                book.save()
-            
-            # Handle authors if provided
-            if authors_string:
-                self._process_authors(book, authors_string)
-            
-            # Create book instance if none exists
-            if not book.book_instances.exists():
-                book_instance_serializer = BookInstanceSerializer(data={
-                    'book': book.pk,
-                    'status': 'A'
-                })
-                if book_instance_serializer.is_valid():
-                    book_instance = book_instance_serializer.save()
-                # Create BookInstanceHistory for the new instance, status 'A'
-                if book_instance and not book_instance.history.exists():
-                    BookInstanceHistory.objects.create(
-                        book_instance=book_instance,
-                        status='A'
-                    )
-                else:
-                    logger.warning(book_instance_serializer.errors)
-                    
-        return book
-    
-    def update(self, instance, validated_data):
-        authors_string = validated_data.pop('authors', None)
-        
-        with transaction.atomic():
-            # Update other fields
-            for attr, value in validated_data.items():
-                setattr(instance, attr, value)
-            instance.save()
-            
-            # Handle authors if provided
-            if authors_string is not None:
-                instance.authors.clear()  # Remove existing relationships
-                self._process_authors(instance, authors_string)
-            
-            # Create book instance if none exists
-            if not instance.book_instances.exists():
-                book_instance_serializer = BookInstanceSerializer(data={
-                    'book': instance.pk,
-                    'status': 'A'
-                })
-                if book_instance_serializer.is_valid():
-                    book_instance = book_instance_serializer.save()
-                # Create BookInstanceHistory for the new instance, status 'A'
-                if book_instance and not book_instance.history.exists():
-                    BookInstanceHistory.objects.create(
-                        book_instance=book_instance,
-                        status='A',
-                        is_returned=True
-                    )
-                else:
-                    logger.warning(book_instance_serializer.errors)
-        return instance
-    
-    def _process_authors(self, book, author_value):
-        if not author_value.strip():
-            return
-            
-        author_names = [name.strip() for name in author_value.split(',')]
-        
-        for author_name in author_names:
-            # Split into given names and surname (assuming last space separates them)
-            parts = author_name.strip().rsplit(' ', 1)
-            if len(parts) == 2:
-                given_names, surname = parts
-            else:
-                given_names = ""
-                surname = parts[0]
-            
-            # Clean up the names
-            given_names = given_names.strip()
-            surname = surname.strip()
-            
-            author, created = Author.objects.get_or_create(
-                given_names=given_names,
-                surname=surname,
-                defaults={'given_names': given_names, 'surname': surname}
-            )
-            book.authors.add(author)
+    # Rows from the CSV import arrive with these fields already checked and
+    # normalized column by column, so they are not checked again per row.
+    def validate_library_id(self, value):
+        return value if self.context.get('prevalidated') else super().validate_library_id(value)
+
+    def validate_isbn(self, value):
+        return value if self.context.get('prevalidated') else super().validate_isbn(value)
+
+    def validate_language(self, value):
+        return value if self.context.get('prevalidated') else super().validate_language(value)
 
 class BookBorrowSerializer(serializers.Serializer):
     book_instance = serializers.PrimaryKeyRelatedField(queryset=BookInstance.objects.all())
 
+class BookBulkLoanSerializer(serializers.Serializer):
+    """Copy ids for bulk borrow and return. Existence is checked by the loan functions in one query."""
+    book_instances = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=100
+    )
+
 class BookWishlistSerializer(serializers.Serializer):
     book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
 
 class BookSearchSerializer(serializers.Serializer):
     """Serializer for book search functionality."""
     query = serializers.CharField(required=True, help_text="Search query (title or author)")
+    mode = serializers.ChoiceField(
+        choices=['fulltext', 'fuzzy'],
+        default='fulltext',
+        help_text="'fuzzy' tolerates misspellings, 'fulltext' matches word prefixes exactly"
+    )
+
+class BookAutocompleteSerializer(serializers.Serializer):
+    """Serializer for autocomplete queries."""
+    q = serializers.CharField(required=True, help_text="Beginning of a title or author name")
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=50)
+
+class LoanHistoryReportSerializer(serializers.Serializer):
+    """Query parameters of the loan history report."""
+    output = serializers.ChoiceField(choices=['json', 'csv', 'ndjson'], default='json')
+    borrowed_from = serializers.DateField(required=False, help_text="Earliest borrowed date, inclusive")
+    borrowed_to = serializers.DateField(required=False, help_text="Latest borrowed date, inclusive")
+
+    def validate(self, data):
+        if data.get('borrowed_from') and data.get('borrowed_to') and data['borrowed_from'] > data['borrowed_to']:
+            raise serializers.ValidationError("borrowed_from must not be after borrowed_to")
+        return data
+
+class BorrowedReportSerializer(LoanHistoryReportSerializer):
+    """Query parameters of the borrowed-books report."""
+    overdue = serializers.BooleanField(default=False, help_text="Only loans past their due date")
 
 class BookInstanceSerializer(serializers.ModelSerializer):
     class Meta:
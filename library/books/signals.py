@@ -0,0 +1,138 @@
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+import logging
+
+from .models import Author, Book, BookInstance, BookStatus
+from . import autocomplete, cache, fuzzy, holds, search
+from .tasks import notify_holders
+from users.models import UserWishlist
+
+logger = logging.getLogger(__name__)
+
+
+def books_changed(book_ids, using=DEFAULT_DB_ALIAS):
+    """Refresh the search indexes and cached responses of these books."""
+    book_ids = list(book_ids)
+    search.index_books(book_ids, using)
+    fuzzy.index_books(book_ids, using)
+    cache.invalidate_books(book_ids)
+
+
+@receiver(post_init, sender=Book)
+def remember_book_label(sender, instance, **kwargs):
+    # Lets saves that keep the title leave the autocomplete index alone.
+    instance._autocomplete_label = autocomplete.loaded_label('book', instance)
+
+
+@receiver(post_save, sender=Book)
+def index_book_on_save(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    books_changed([instance.pk], using)
+    autocomplete.index.update('book', instance, created)
+
+
+@receiver(pre_delete, sender=Book)
+def unindex_book_terms_on_delete(sender, instance, using=None, **kwargs):
+    # Before the delete, while the book's links still say which terms it used.
+    fuzzy.remove_books([instance.pk], using)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book_on_delete(sender, instance, using=None, **kwargs):
+    search.remove_books([instance.pk], using)
+    cache.invalidate_books([instance.pk])
+    autocomplete.index.remove('book', instance.pk)
+
+
+@receiver(post_init, sender=Author)
+def remember_author_label(sender, instance, **kwargs):
+    instance._autocomplete_label = autocomplete.loaded_label('author', instance)
+
+
+@receiver(post_save, sender=Author)
+def index_author_books_on_save(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    book_ids = list(instance.books.values_list('id', flat=True))
+    Book.touch(book_ids)
+    books_changed(book_ids, using)
+    autocomplete.index.update('author', instance, created)
+
+
+@receiver(pre_delete, sender=Author)
+def collect_author_books_on_delete(sender, instance, **kwargs):
+    # The M2M rows are gone by post_delete, so remember which books to re-index.
+    instance._indexed_book_ids = list(instance.books.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def index_author_books_on_delete(sender, instance, using=None, **kwargs):
+    book_ids = getattr(instance, '_indexed_book_ids', [])
+    Book.touch(book_ids)
+    books_changed(book_ids, using)
+    autocomplete.index.remove('author', instance.pk)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def index_books_on_authors_changed(sender, instance, action, reverse, pk_set, using=None, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Book.touch([instance.pk])
+            books_changed([instance.pk], using)
+        return
+
+    # Changed from the author side, so pk_set holds book ids.
+    if action == 'pre_clear':
+        instance._indexed_book_ids = list(instance.books.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        Book.touch(pk_set)
+        books_changed(pk_set, using)
+    elif action == 'post_clear':
+        Book.touch(instance._indexed_book_ids)
+        books_changed(instance._indexed_book_ids, using)
+
+
+def _adjust_copy_counts(instance, copies=0, available=0):
+    Book.adjust_copy_counts(instance.book_id, copies, available)
+    cache.invalidate_books([instance.book_id])
+    # Keep an already loaded book in step with the stored counters.
+    if BookInstance.book.is_cached(instance):
+        instance.book.copy_count += copies
+        instance.book.available_count += available
+
+
+@receiver(post_save, sender=BookInstance)
+def count_copies_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    available = instance.status == BookStatus.AVAILABLE
+    if created:
+        _adjust_copy_counts(instance, copies=1, available=int(available))
+    else:
+        loaded_status = getattr(instance, '_loaded_status', instance.status)
+        delta = int(available) - int(loaded_status == BookStatus.AVAILABLE)
+        _adjust_copy_counts(instance, available=delta)
+        if loaded_status != instance.status and not delta:
+            # e.g. borrowed to missing: the counters stay, but the book's validators must change.
+            Book.touch([instance.book_id])
+    instance._loaded_status = instance.status
+
+
+@receiver(pre_delete, sender=BookInstance)
+def drop_hold_on_copy_delete(sender, instance, **kwargs):
+    # The holder keeps their place and is offered the next copy that comes back.
+    UserWishlist.objects.filter(held_copy_id=instance.pk).update(held_copy=None, hold_expires_at=None)
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_copies_on_delete(sender, instance, **kwargs):
+    was_available = getattr(instance, '_loaded_status', instance.status) == BookStatus.AVAILABLE
+    _adjust_copy_counts(instance, copies=-1, available=-int(was_available))
+
+
+@receiver(post_delete, sender=UserWishlist)
+def release_hold_on_wishlist_delete(sender, instance, **kwargs):
+    # A held copy goes to the next user in the queue, or back on the shelf.
+    notify_holders(holds.release_hold(instance))
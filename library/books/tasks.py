@@ -3,11 +3,19 @@ import logging
 from time import time
 from celery import shared_task
 from django.db import transaction
+from django.db.models import Exists, Q
+from django.utils import timezone
 from django.core.files.storage import default_storage
 from django.core.mail import send_mail
 from django.conf import settings
-from .serializers import BookImportSerializer
-from .models import Book
+from . import autocomplete, cache as book_cache
+from .archive import archive_history
+from .holds import expire_holds
+from .authors import AuthorResolver
+from .importer import import_rows, read_chunks, validate_chunk
+from .loans import later_history
+from .models import Book, BookInstanceHistory
+from users.models import CustomUser, UserWishlist
 import requests
 
 logger = logging.getLogger(__name__)
@@ -40,64 +48,39 @@ def process_csv_task(self, file_path, user_email=None):
     try:
         with default_storage.open(file_path, mode='r') as f:
             try:
-                df = pd.read_csv(f)
+                # Read, clean and import one chunk at a time so memory use does not grow with the file
+                dropped = 0
+                authors = AuthorResolver()  # remembers authors across chunks
+                for chunk, chunk_dropped in read_chunks(f):
+                    results["total_processed"] += len(chunk) + chunk_dropped
+                    dropped += chunk_dropped
+                    # Set invalid rows aside before any database work
+                    chunk, rejected = validate_chunk(chunk)
+                    imported, errors = import_rows(
+                        [(index + 1, row) for index, row in zip(chunk.index, chunk.to_dict('records'))],
+                        prevalidated=True,
+                        authors=authors
+                    )
+                    results["success"] += imported
+                    results["errors"].extend(sorted(rejected + errors, key=lambda error: error["row"]))
+                    self.update_state(state='PROGRESS', meta={
+                        "processed": results["total_processed"],
+                        "success": results["success"],
+                        "errors": len(results["errors"]),
+                    })
+                    logger.info(f"Processed {results['total_processed']} rows of {file_path}")
 
-                # Quickly check the CSV header for appropriate fields
-                required_fields = ['id', 'authors', 'publication year', 'title', 'language']
-                df.columns = [str(i).lower() for i in df.columns]
-                if not all(field in df.columns for field in required_fields):
-                    raise ValueError(f'CSV must contain the following fields: {", ".join(required_fields)}')
+                if results["success"]:
+                    # Once per file rather than per chunk, as every process reloads the index
+                    autocomplete.index.invalidate()
 
-                results["total_processed"] = len(df)
-                
-                # Standardize column names
-                df.columns = df.columns.str.strip().str.lower()                
-                # Rename columns to match model fields
-                df.rename(columns={
-                    "id": "library_id",
-                    "publication year": "publication_year",
-                }, inplace=True, errors='ignore')  # Ignore if columns don't exist
-                
-                # Preprocess - drop rows with missing data
-                initial_count = len(df)
-                df = df.dropna(subset=["isbn", "title"])
-                if len(df) < initial_count:
-                    logger.warning(f"Dropped {initial_count - len(df)} rows with missing ISBN or title")
-                    results["errors"].append({
+                if dropped:
+                    logger.warning(f"Dropped {dropped} rows with missing ISBN or title")
+                    results["errors"].insert(0, {
                         "row": "",
-                        "errors": f"Dropped {initial_count - len(df)} rows with missing ISBN or title"
+                        "errors": f"Dropped {dropped} rows with missing ISBN or title"
                     })
                 
-                # Clean and standardize data
-                df["library_id"] = df["library_id"].astype(str).str.strip().str.zfill(10)
-                df["isbn"] = df["isbn"].astype(str).str.strip().str.zfill(13)
-                df["language"] = df["language"].str.lower().str.strip()
-                df["authors"] = df["authors"].fillna("Unknown")
-                
-                # Process in chunks for better memory management
-                chunk_size = 100
-                for i in range(0, len(df), chunk_size):
-                    chunk = df[i:i + chunk_size]
-                    with transaction.atomic():
-                        for index, row in chunk.iterrows():
-                            try:
-                                serializer = BookImportSerializer(data=row.to_dict())
-                                if serializer.is_valid():
-                                    serializer.save()
-                                    results["success"] += 1
-                                else:
-                                    logger.error("Serializer Errors:", serializer.errors)
-                                    results["errors"].append({
-                                        "row": index + 1,
-                                        "errors": serializer.errors
-                                    })
-                            except Exception as e:
-                                logger.error(f"Error processing row {index}: {str(e)}")
-                                results["errors"].append({
-                                    "row": index + 1,
-                                    "errors": str(e)
-                                })
-                
                 # Calculate processing time
                 processing_time = time() - start_time
                 results["processing_time_seconds"] = round(processing_time, 2)
@@ -181,6 +164,138 @@ def send_processing_completion_email(user_email, file_path, successes, errors, t
         logger.error(f"Failed to send completion email to {user_email}: {str(e)}")
         raise
 
+def _wishlist_email_key(user_id, book_id):
+    return f'books:wishlist-email:{user_id}:{book_id}'
+
+
+@shared_task(ignore_result=True)
+def send_wishlist_email_task(wishlist_id):
+    """
+    Email the owner of a wishlist entry that a copy of the book is held for them.
+
+    Each user is emailed about a book at most once per
+    ``WISHLIST_EMAIL_DEDUP_TIMEOUT`` seconds, however often it is returned.
+    """
+    entry = UserWishlist.objects.filter(pk=wishlist_id).select_related('user', 'book').first()
+    if entry is None:
+        return
+    key = _wishlist_email_key(entry.user_id, entry.book_id)
+    cache = book_cache.get_cache()
+    # Claim the key atomically so concurrent tasks cannot both send.
+    if not cache.add(key, True, timeout=getattr(settings, 'WISHLIST_EMAIL_DEDUP_TIMEOUT', 24 * 60 * 60)):
+        logger.info(f"Skipping duplicate wishlist email to user {entry.user_id} for book {entry.book_id}")
+        return
+    # Only a sent email counts, so a failed send is retried on the next return.
+    if not entry.user.send_wishlist_email(entry.book, hold_expires_at=entry.hold_expires_at):
+        cache.delete(key)
+
+
+def _queue_wishlist_email(wishlist_id):
+    # Outside a transaction on_commit runs at once, and the hold is saved by
+    # then, so a broker error is logged rather than failing the request.
+    try:
+        send_wishlist_email_task.delay(wishlist_id)
+    except Exception as e:
+        logger.error(f"Failed to queue wishlist email for entry {wishlist_id}: {str(e)}")
+
+
+def notify_holders(holds):
+    """Queue an email to each new holder once the current transaction commits."""
+    for entry in holds:
+        transaction.on_commit(lambda wishlist_id=entry.pk: _queue_wishlist_email(wishlist_id))
+
+
+@shared_task(ignore_result=True)
+def expire_holds_task():
+    """Drop expired holds and pass their copies to the next users in the queues."""
+    expired, holds = expire_holds()
+    notify_holders(holds)
+    if expired:
+        logger.info(f"Expired {expired} holds, {len(holds)} copies passed on")
+    return expired
+
+
+OVERDUE_BATCH_SIZE = 1000
+
+
+@shared_task(ignore_result=True)
+def send_overdue_reminder_task(user_id, loan_ids):
+    """
+    Email a user one reminder listing the given overdue loans that have not
+    been reminded yet, and stamp those loans with ``reminder_sent_at`` once the
+    email is sent. A failed send leaves them for the next run.
+    """
+    user = CustomUser.objects.filter(pk=user_id).first()
+    if user is None:
+        return
+    with transaction.atomic():
+        # A concurrent duplicate of this task waits on the lock, then finds the loans stamped.
+        loans = list(
+            BookInstanceHistory.objects.select_for_update(of=('self',))
+            .filter(pk__in=loan_ids, is_returned=False, reminder_sent_at__isnull=True)
+            .select_related('book_instance__book').order_by('due_date')
+        )
+        if loans and user.send_overdue_email(loans):
+            BookInstanceHistory.objects.filter(pk__in=[loan.pk for loan in loans]).update(reminder_sent_at=timezone.now())
+
+
+@shared_task
+def send_overdue_reminders_task(batch_size=OVERDUE_BATCH_SIZE):
+    """
+    Queue one reminder email per user with overdue loans that have not been
+    reminded yet.
+
+    Loans are read through the ``overdue_reminder_idx`` partial index in
+    ``(due_date, id)`` keyset batches. Each batch also picks up its users'
+    remaining overdue loans, so every user gets a single message.
+    ``send_overdue_reminder_task`` stamps loans with ``reminder_sent_at`` only
+    after their email is sent, which makes later runs skip them and retry
+    failed sends. Open loans followed by a later history row of the same copy
+    were returned before loans were closed on return (see
+    ``loans.close_superseded_loans``) and are skipped.
+    """
+    now = timezone.now()
+    overdue = BookInstanceHistory.objects.filter(
+        is_returned=False, reminder_sent_at__isnull=True, due_date__lt=now
+    ).exclude(Exists(later_history())).order_by()
+    queued_users = set()
+    reminded_loans = 0
+    last = None
+    while True:
+        page = overdue
+        if last is not None:
+            page = page.filter(Q(due_date__gt=last[0]) | Q(due_date=last[0], id__gt=last[1]))
+        batch = list(page.order_by('due_date', 'id').values_list('id', 'due_date', 'user_id')[:batch_size])
+        if not batch:
+            break
+        last = (batch[-1][1], batch[-1][0])
+
+        # Users queued from an earlier batch already had all their loans listed.
+        user_ids = {user_id for _, _, user_id in batch if user_id is not None} - queued_users
+        if not user_ids:
+            continue
+        loans_by_user = {}
+        for loan_id, user_id in overdue.filter(user_id__in=user_ids).values_list('id', 'user_id'):
+            loans_by_user.setdefault(user_id, []).append(loan_id)
+        for user_id, ids in loans_by_user.items():
+            # robust: a broker error for one user is logged and the others are still queued
+            transaction.on_commit(
+                lambda user_id=user_id, ids=ids: send_overdue_reminder_task.delay(user_id, ids), robust=True
+            )
+            reminded_loans += len(ids)
+        queued_users.update(loans_by_user)
+
+    logger.info(f"Queued overdue reminders for {reminded_loans} loans to {len(queued_users)} users")
+    return {'users': len(queued_users), 'loans': reminded_loans}
+
+
+@shared_task
+def archive_history_task():
+    """Move closed loan history past the configured age into the archive."""
+    moved, archived = archive_history()
+    return {'moved': moved, 'archived': archived}
+
+
 @shared_task
 def process_amazon_ids_task():
     """For all books without an amazon_id, query the OpenLibraryAPI https://openlibrary.org/dev/docs/api/search for the id"""
@@ -1,6 +1,58 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
 from django.test import TestCase
-from .models import Author, Book, BookInstance, BookStatus
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from . import cache as book_cache, loans
+from .archive import archive_history
+from .authors import AuthorResolver, author_slug
+from .autocomplete import VERSION_KEY, index as autocomplete_index
+from .facets import compute_facets
+from .importer import import_rows, normalize_isbns, read_chunks, validate_chunk
+from .loans import borrow_copy, close_superseded_loans, return_copy
+from .models import (
+    Author, Book, BookInstance, BookInstanceHistory, BookInstanceHistoryArchive, BookStatus, SearchTerm,
+    SearchTrigram,
+)
+from .search import search_books
+from .serializers import BookSerializer
+from .tasks import (
+    expire_holds_task, process_csv_task, send_overdue_reminder_task, send_overdue_reminders_task,
+    send_wishlist_email_task,
+)
+from users.models import UserWishlist
+
+User = get_user_model()
+
+
+class APITestBase(TestCase):
+    """Runs each test with an API client authenticated as ``username``."""
+    username = 'reader'
+    is_staff = False
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username=cls.username, email=f'{cls.username}@example.com', password='pass1234', is_staff=cls.is_staff
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
 
 
 class AuthorModelTests(TestCase):
@@ -98,7 +150,6 @@ class BookSerializerValidationTests(TestCase):
         self.author = Author.objects.create(given_names="Leo", surname="Tolstoy")
 
     def test_invalid_library_id(self):
-        from .serializers import BookSerializer
         serializer = BookSerializer(data={
             'title': 'War and Peace',
             'authors': [self.author.id],
@@ -109,7 +160,6 @@ class BookSerializerValidationTests(TestCase):
         self.assertIn('library_id', serializer.errors)
 
     def test_invalid_isbn(self):
-        from .serializers import BookSerializer
         serializer = BookSerializer(data={
             'title': 'Anna Karenina',
             'authors': [self.author.id],
@@ -119,3 +169,984 @@ class BookSerializerValidationTests(TestCase):
         self.assertFalse(serializer.is_valid())
         self.assertIn('isbn', serializer.errors)
 
+    def test_language_codes_and_names(self):
+        serializer = BookSerializer()
+        for value, name in [
+            ('en', 'English'), ('EN', 'English'), ('deu', 'German'), ('zh_Hant', 'Chinese (Traditional)'),
+            ('en-US', 'English - United States'), ('french', 'French'), ('xx', 'Unknown'),
+        ]:
+            self.assertEqual(serializer.validate_language(value), name)
+
+    def test_ambiguous_language(self):
+        # Differs only in case from another language name
+        with self.assertRaises(ValidationError):
+            BookSerializer().validate_language("n'ko")
+
+
+class BookSearchTests(APITestBase):
+    """Tests for the full-text search index and the search endpoint."""
+    username = 'reader'
+
+    def setUp(self):
+        super().setUp()
+        self.emily = Author.objects.create(given_names="Emily", surname="Brontë")
+        self.charlotte = Author.objects.create(given_names="Charlotte", surname="Brontë")
+        self.book = Book.objects.create(title="Wuthering Heights", library_id="LIB0000020", isbn="1234567890200")
+        self.book.authors.add(self.emily, self.charlotte)
+
+    def test_search_is_deduplicated_and_ignores_diacritics(self):
+        response = self.client.get('/api/books/search/', {'query': 'bronte'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['id'] for b in response.data['results']], [self.book.id])
+
+    def test_title_matches_rank_first(self):
+        other = Book.objects.create(title="Jane Eyre", library_id="LIB0000021", isbn="1234567890201")
+        other.authors.add(Author.objects.create(given_names="Heights", surname="Author"))
+        response = self.client.get('/api/books/search/', {'query': 'heights'})
+        self.assertEqual([b['id'] for b in response.data['results']], [self.book.id, other.id])
+
+    def test_index_follows_author_changes(self):
+        self.emily.surname = "Bell"
+        self.emily.save()
+        self.assertIn(self.book, search_books(Book.objects.all(), 'bell'))
+        self.book.authors.remove(self.emily)
+        self.assertNotIn(self.book, search_books(Book.objects.all(), 'bell'))
+
+    def test_fuzzy_search_tolerates_misspellings(self):
+        dostoevsky = Author.objects.create(given_names="Fyodor", surname="Dostoevsky")
+        crime = Book.objects.create(title="Crime and Punishment", library_id="LIB0000022", isbn="1234567890202")
+        crime.authors.add(dostoevsky)
+        response = self.client.get('/api/books/search/', {'query': 'Dostoyevsky', 'mode': 'fuzzy'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['id'] for b in response.data['results']], [crime.id])
+        response = self.client.get('/api/books/search/', {'query': 'Wutherin Hieghts', 'mode': 'fuzzy'})
+        self.assertEqual(response.data['results'][0]['id'], self.book.id)
+
+    def test_fuzzy_vocabulary_drops_unused_terms(self):
+        other = Book.objects.create(title="Heights of Solaris", library_id="LIB0000023", isbn="1234567890203")
+        self.book.title = "Jane Eyre"
+        self.book.save()
+        terms = set(SearchTerm.objects.values_list('term', flat=True))
+        self.assertNotIn("wuthering", terms)
+        self.assertTrue({"heights", "eyre"} <= terms)
+        other.delete()
+        terms = set(SearchTerm.objects.values_list('term', flat=True))
+        self.assertFalse({"heights", "solaris"} & terms)
+        self.assertIn("bronte", terms)
+        self.assertFalse(SearchTrigram.objects.exclude(term__in=SearchTerm.objects.all()).exists())
+
+
+class KeysetPaginationTests(APITestBase):
+    """Tests for cursor pagination on the book list."""
+    username = 'pager'
+
+    def setUp(self):
+        super().setUp()
+        # Duplicate titles check that the id tie breaker keeps positions unique.
+        for i in range(5):
+            Book.objects.create(title=f"Title {i // 2}", library_id=f"LIB00001{i:02d}", isbn=f"12345678901{i:02d}")
+
+    def test_walks_pages_forwards_and_backwards(self):
+        expected = list(Book.objects.order_by('title', 'id').values_list('id', flat=True))
+        response = self.client.get('/api/books/', {'page_size': 2})
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        seen = [b['id'] for b in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [b['id'] for b in response.data['results']]
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([b['id'] for b in response.data['results']], expected[2:4])
+
+    def test_count_is_opt_in(self):
+        response = self.client.get('/api/books/', {'count': 'true'})
+        self.assertEqual(response.data['count'], 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/books/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class BookQueryCountTests(APITestBase):
+    """The book list should cost the same number of queries for any page size."""
+    username = 'counter'
+
+    def setUp(self):
+        super().setUp()
+        author = Author.objects.create(given_names="Ursula", surname="Le Guin")
+        for i in range(10):
+            book = Book.objects.create(title=f"Earthsea {i}", library_id=f"LIB00002{i:02d}", isbn=f"12345678902{i:02d}")
+            book.authors.add(author)
+            BookInstance.objects.create(book=book, status=BookStatus.AVAILABLE)
+            BookInstance.objects.create(book=book, status=BookStatus.BORROWED)
+
+    def test_list_query_count_is_constant(self):
+        self.client.get('/api/books/')  # Warm the facet cache, which is shared across page sizes.
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/books/', {'page_size': 2, 'expand': 'book_instances'})
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/books/', {'page_size': 10, 'expand': 'book_instances'})
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(response.data['results'][0]['total_copies'], 2)
+        self.assertEqual(response.data['results'][0]['available_copies'], 1)
+        self.assertEqual(len(response.data['results'][0]['book_instances']), 2)
+
+    def test_sparse_fields_and_expansion(self):
+        response = self.client.get('/api/books/')
+        self.assertNotIn('book_instances', response.data['results'][0])
+
+        with CaptureQueriesContext(connection) as sparse:
+            response = self.client.get('/api/books/', {'fields': 'id,title,available_copies'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'available_copies'})
+        with CaptureQueriesContext(connection) as expanded:
+            response = self.client.get('/api/books/', {'fields': 'id', 'expand': 'book_instances'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'book_instances'})
+        self.assertEqual(len(expanded), len(sparse) + 1)
+
+
+class CopyCounterTests(TestCase):
+    """Tests for the stored copy counters on Book."""
+
+    def setUp(self):
+        self.book = Book.objects.create(title="Dune", library_id="LIB0000300", isbn="1234567890300")
+
+    def test_counters_follow_instance_changes(self):
+        first = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_copies, self.book.available_copies), (2, 2))
+
+        first = BookInstance.objects.get(pk=first.pk)
+        first.status = BookStatus.BORROWED
+        first.save()
+        first.save()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_copies, self.book.available_copies), (2, 1))
+
+        first.delete()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_copies, self.book.available_copies), (1, 1))
+
+    def test_saving_a_stale_book_keeps_the_counters(self):
+        stale = Book.objects.get(pk=self.book.pk)
+        BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        stale.amazon_id = "B000000001"
+        stale.save()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copy_count, self.book.available_count), (1, 1))
+        self.assertEqual(self.book.amazon_id, "B000000001")
+
+    def test_recount_copies_repairs_drift(self):
+        BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        Book.objects.filter(pk=self.book.pk).update(copy_count=7, available_count=0)
+        out = StringIO()
+        call_command('recount_copies', stdout=out)
+        self.assertIn("Repaired 1 books", out.getvalue())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copy_count, self.book.available_count), (1, 1))
+
+
+class BookCacheTests(APITestBase):
+    """Tests for the book response cache and its invalidation."""
+    username = 'cached'
+
+    def setUp(self):
+        super().setUp()
+        self.author = Author.objects.create(given_names="Iain", surname="Banks")
+        self.book = Book.objects.create(title="Excession", library_id="LIB0000400", isbn="1234567890400")
+        self.book.authors.add(self.author)
+
+    def test_detail_is_cached_until_the_book_changes(self):
+        url = f'/api/books/{self.book.id}/'
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['available_copies'], 1)
+
+        self.author.surname = "M. Banks"
+        self.author.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['authors_display'], "Iain M. Banks")
+
+    def test_list_is_invalidated_by_catalog_changes(self):
+        self.client.get('/api/books/')
+        self.assertEqual(self.client.get('/api/books/')['X-Cache'], 'HIT')
+        Book.objects.create(title="Matter", library_id="LIB0000401", isbn="1234567890401")
+        response = self.client.get('/api/books/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class ConditionalGetTests(APITestBase):
+    """Tests for ETag/Last-Modified handling on the catalog endpoints."""
+    username = 'etag'
+
+    def setUp(self):
+        super().setUp()
+        self.author = Author.objects.create(given_names="Octavia", surname="Butler")
+        self.book = Book.objects.create(title="Kindred", library_id="LIB0000500", isbn="1234567890500")
+        self.book.authors.add(self.author)
+        self.instance = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+
+    def test_unchanged_detail_returns_304(self):
+        url = f'/api/books/{self.book.id}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_repeated_requests_skip_the_validator_query(self):
+        for url in ('/api/books/', f'/api/books/{self.book.id}/'):
+            etag = self.client.get(url)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(queries), 0)
+
+    def test_instance_status_change_changes_validator(self):
+        etag = self.client.get('/api/books/')['ETag']
+        self.instance.status = BookStatus.BORROWED
+        self.instance.save()
+        response = self.client.get('/api/books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_status_changes_that_keep_the_counters_change_validator(self):
+        url = f'/api/books/{self.book.id}/?expand=book_instances'
+        borrow_copy(self.instance, self.user)
+        waiting = User.objects.create_user(username='next', email='next@example.com', password='pass1234')
+        UserWishlist.objects.create(user=waiting, book=self.book)
+
+        # Borrowed to reserved for the waiting user
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(return_copy(self.instance, self.user)[1])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Reserved to borrowed by the holder
+        etag = self.client.get(url)['ETag']
+        borrow_copy(self.instance, waiting)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Borrowed to missing
+        etag = self.client.get(url)['ETag']
+        instance = BookInstance.objects.get(pk=self.instance.pk)
+        instance.status = BookStatus.MISSING
+        instance.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_author_endpoints_support_conditional_get(self):
+        etag = self.client.get('/api/authors/')['ETag']
+        self.assertEqual(self.client.get('/api/authors/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Author.objects.create(given_names="N. K.", surname="Jemisin")
+        self.assertEqual(self.client.get('/api/authors/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/authors/abc/').status_code, 404)
+
+
+class FacetTests(APITestBase):
+    """Tests for the facet counts on list and search responses."""
+    username = 'facets'
+
+    def setUp(self):
+        super().setUp()
+        for i, (language, year) in enumerate([('English', 1965), ('English', 1969), ('French', 1972), ('French', None)]):
+            book = Book.objects.create(
+                title=f"Solaris {i}", language=language, publication_year=year,
+                library_id=f"LIB00006{i:02d}", isbn=f"12345678906{i:02d}"
+            )
+            if i % 2 == 0:
+                BookInstance.objects.create(book=book, status=BookStatus.AVAILABLE)
+
+    def test_list_facets(self):
+        facets = self.client.get('/api/books/', {'page_size': 1}).data['facets']
+        self.assertEqual(facets['language'], [{'value': 'English', 'count': 2}, {'value': 'French', 'count': 2}])
+        self.assertEqual(facets['decade'], [{'value': 1960, 'count': 2}, {'value': 1970, 'count': 1}])
+        self.assertEqual(facets['available'], [{'value': True, 'count': 2}, {'value': False, 'count': 2}])
+
+        # The next page reuses the cached facet counts.
+        next_url = self.client.get('/api/books/', {'page_size': 1}).data['next']
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(next_url)
+        self.assertFalse(any('GROUP BY' in q['sql'] for q in queries.captured_queries))
+
+    def test_search_facets_follow_the_query_and_filters(self):
+        response = self.client.get('/api/books/search/', {'query': 'solaris', 'language': 'French'})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['facets']['language'], [{'value': 'French', 'count': 2}])
+        facets = self.client.get('/api/books/search/', {'query': 'solaris'}).data['facets']
+        self.assertEqual(sum(f['count'] for f in facets['language']), 4)
+        facets = self.client.get('/api/books/', {'language': 'French'}).data['facets']
+        self.assertEqual(facets['language'], [{'value': 'French', 'count': 2}])
+
+    def test_decades_round_down_before_year_zero(self):
+        Book.objects.create(title="Odyssey", publication_year=-5, library_id="LIB0000690", isbn="1234567890690")
+        decades = compute_facets(Book.objects.all())['decade']
+        self.assertEqual(decades[0], {'value': -10, 'count': 1})
+
+
+class AutocompleteTests(APITestBase):
+    """Tests for the prefix autocomplete endpoint."""
+    username = 'typist'
+
+    def setUp(self):
+        super().setUp()
+        self.author = Author.objects.create(given_names="Gabriel", surname="García Márquez")
+        self.book = Book.objects.create(title="One Hundred Years of Solitude", library_id="LIB0000700", isbn="1234567890700")
+        Book.objects.create(title="Love in the Time of Cholera", library_id="LIB0000701", isbn="1234567890701")
+        autocomplete_index.load()
+
+    def test_prefix_matches_titles_and_authors(self):
+        response = self.client.get('/api/books/autocomplete/', {'q': 'one hun'})
+        self.assertEqual(response.data['results'], [
+            {'type': 'book', 'id': self.book.id, 'label': "One Hundred Years of Solitude"}
+        ])
+        response = self.client.get('/api/books/autocomplete/', {'q': 'garcia'})
+        self.assertEqual([r['id'] for r in response.data['results']], [self.author.id])
+
+    def test_index_is_updated_in_place(self):
+        self.book.title = "Chronicle of a Death Foretold"
+        self.book.save()
+        self.assertEqual(self.client.get('/api/books/autocomplete/', {'q': 'one'}).data['results'], [])
+        self.assertEqual(len(self.client.get('/api/books/autocomplete/', {'q': 'chron'}).data['results']), 1)
+        self.book.delete()
+        self.assertEqual(self.client.get('/api/books/autocomplete/', {'q': 'chron'}).data['results'], [])
+
+    def test_saves_that_keep_the_label_leave_the_version_alone(self):
+        version = book_cache.get_cache().get(VERSION_KEY, 0)
+        book = Book.objects.get(pk=self.book.pk)
+        book.amazon_id = "http://example.com/dp/1"
+        book.save()
+        self.author.save()
+        self.assertEqual(book_cache.get_cache().get(VERSION_KEY, 0), version)
+        book.title = "Chronicle of a Death Foretold"
+        book.save()
+        self.assertEqual(book_cache.get_cache().get(VERSION_KEY, 0), version + 1)
+
+    def test_stale_index_is_served_while_reloading(self):
+        Book.objects.filter(pk=self.book.pk).update(title="Chronicle of a Death Foretold")
+        autocomplete_index.invalidate()
+        with patch.object(autocomplete_index, '_reload_in_background') as reload:
+            response = self.client.get('/api/books/autocomplete/', {'q': 'one hun'})
+        self.assertEqual(len(response.data['results']), 1)
+        reload.assert_called_once_with()
+        autocomplete_index.load()
+        self.assertEqual(self.client.get('/api/books/autocomplete/', {'q': 'one hun'}).data['results'], [])
+
+
+class BorrowReturnTests(APITestBase):
+    """Tests for the conditional borrow and return transitions."""
+    username = 'borrower'
+
+    def setUp(self):
+        super().setUp()
+        self.book = Book.objects.create(title="Beloved", library_id="LIB0000800", isbn="1234567890800")
+        self.instance = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+
+    def test_second_borrow_of_same_copy_fails(self):
+        response = self.client.post('/api/books/borrow/', {'book_instance': self.instance.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/books/borrow/', {'book_instance': self.instance.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(BookInstanceHistory.objects.filter(is_returned=False).count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 0)
+
+    def test_superseded_open_loans_are_closed(self):
+        borrowed = timezone.now() - timedelta(days=30)
+        # A loan left open by the old return path, followed by its return row
+        stale = BookInstanceHistory.objects.create(
+            book_instance=self.instance, status=BookStatus.BORROWED, user=self.user,
+            borrowed_date=borrowed, due_date=borrowed + timedelta(days=14), is_returned=False
+        )
+        returned = BookInstanceHistory.objects.create(
+            book_instance=self.instance, status=BookStatus.AVAILABLE, user=self.user,
+            returned_date=borrowed + timedelta(days=3), is_returned=True
+        )
+        self.assertEqual(close_superseded_loans(), 1)
+        stale.refresh_from_db()
+        self.assertTrue(stale.is_returned)
+        self.assertEqual(stale.returned_date, returned.returned_date)
+        self.assertEqual(close_superseded_loans(), 0)
+
+    def test_return_closes_the_open_loan(self):
+        waiting = User.objects.create_user(username='waiting', email='waiting@example.com', password='pass1234')
+        entry = UserWishlist.objects.create(user=waiting, book=self.book)
+        self.client.post('/api/books/borrow/', {'book_instance': self.instance.id}, format='json')
+        with patch('books.tasks.send_wishlist_email_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/books/return_book/', {'book_instance': self.instance.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once_with(entry.id)
+        loan = BookInstanceHistory.objects.get(status=BookStatus.BORROWED)
+        self.assertTrue(loan.is_returned)
+        self.assertIsNotNone(loan.returned_date)
+
+        response = self.client.post('/api/books/return_book/', {'book_instance': self.instance.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        # The copy is held for the waiting user
+        response = self.client.post('/api/books/borrow/', {'book_instance': self.instance.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        UserWishlist.objects.filter(pk=entry.pk).delete()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 1)
+        response = self.client.post('/api/books/borrow/', {'book_instance': self.instance.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_borrowed_report_is_one_joined_query(self):
+        self.user.is_staff = True
+        self.user.save()
+        for _ in range(3):
+            copy = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+            self.client.post('/api/books/borrow/', {'book_instance': copy.id}, format='json')
+        # A copy borrowed before current_loan existed
+        BookInstance.objects.filter(pk=copy.pk).update(current_loan=None)
+        call_command('link_current_loans', stdout=StringIO())
+        copy.refresh_from_db()
+        self.assertEqual(copy.current_loan.user, self.user)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/books/report/')
+            report = json.loads(b''.join(response.streaming_content))['report']
+        self.assertEqual(len(report), 3)
+        self.assertEqual({row['borrower'] for row in report}, {'borrower'})
+
+        self.client.post('/api/books/return_book/', {'book_instance': copy.id}, format='json')
+        copy.refresh_from_db()
+        self.assertIsNone(copy.current_loan)
+
+    def test_borrowed_report_streams_csv_and_ndjson_with_filters(self):
+        self.user.is_staff = True
+        self.user.save()
+        late = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        self.client.post('/api/books/borrow/', {'book_instance': self.instance.id}, format='json')
+        self.client.post('/api/books/borrow/', {'book_instance': late.id}, format='json')
+        long_ago = timezone.now() - timedelta(days=30)
+        BookInstanceHistory.objects.filter(book_instance=late, is_returned=False).update(
+            borrowed_date=long_ago, due_date=long_ago + timedelta(days=14)
+        )
+
+        response = self.client.get('/api/books/report/', {'output': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), ['book_title', 'book_id', 'bookinstance_id', 'book_status', 'borrower', 'borrowed_date', 'due_date'])
+        self.assertEqual(len(lines), 3)
+
+        response = self.client.get('/api/books/report/', {'output': 'ndjson', 'overdue': 'true'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['bookinstance_id'] for row in rows], [late.id])
+
+        response = self.client.get('/api/books/report/', {'output': 'ndjson', 'borrowed_from': timezone.localdate().isoformat()})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['bookinstance_id'] for row in rows], [self.instance.id])
+
+        response = self.client.get('/api/books/report/', {'borrowed_from': '2025-02-01', 'borrowed_to': '2025-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_at_most_one_open_loan_per_copy(self):
+        BookInstanceHistory.objects.create(book_instance=self.instance, status=BookStatus.BORROWED, is_returned=False)
+        with self.assertRaises(IntegrityError):
+            BookInstanceHistory.objects.create(book_instance=self.instance, status=BookStatus.BORROWED, is_returned=False)
+
+    def test_borrow_by_title_claims_the_next_free_copy(self):
+        second = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        url = f'/api/books/{self.book.id}/borrow/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['book_instance']['id'], self.instance.id)
+        self.assertEqual(response.data['book_instance']['status'], BookStatus.BORROWED)
+        self.assertEqual(self.client.post(url).data['book_instance']['id'], second.id)
+        self.assertEqual(self.client.post(url).status_code, 400)
+
+    def test_borrow_by_title_skips_a_copy_lost_to_a_race(self):
+        second = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        real_borrow_copy = loans.borrow_copy
+
+        def lose_first_claim(book_instance, user):
+            if book_instance.pk == self.instance.pk:
+                BookInstance.objects.filter(pk=self.instance.pk).update(status=BookStatus.BORROWED)
+            return real_borrow_copy(book_instance, user)
+
+        with patch.object(loans, 'borrow_copy', side_effect=lose_first_claim):
+            copy, loan = loans.borrow_any_copy(self.book, self.user)
+        self.assertEqual(copy.pk, second.pk)
+        self.assertEqual(loan.book_instance_id, second.pk)
+
+    def test_bulk_borrow_and_return_report_per_item_outcomes(self):
+        other_book = Book.objects.create(title="Jazz", library_id="LIB0000801", isbn="1234567890801")
+        second = BookInstance.objects.create(book=other_book, status=BookStatus.AVAILABLE)
+        missing = BookInstance.objects.create(book=other_book, status=BookStatus.MISSING)
+        UserWishlist.objects.create(user=self.user, book=other_book)
+        ids = [self.instance.id, second.id, missing.id, 999999]
+
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/books/bulk_borrow/', {'book_instances': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['borrowed'], 2)
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['borrowed', 'borrowed', 'unavailable', 'not_found']
+        )
+        self.assertEqual(BookInstanceHistory.objects.filter(is_returned=False).count(), 2)
+        self.assertFalse(UserWishlist.objects.filter(user=self.user).exists())
+        other_book.refresh_from_db()
+        self.assertEqual(other_book.available_count, 0)
+
+        with patch('books.tasks.send_wishlist_email_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/books/bulk_return/', {'book_instances': ids}, format='json')
+        self.assertEqual(response.data['returned'], 2)
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['returned', 'returned', 'not_borrowed', 'not_found']
+        )
+        delay.assert_not_called()
+        self.assertFalse(BookInstanceHistory.objects.filter(is_returned=False).exists())
+        self.book.refresh_from_db()
+        other_book.refresh_from_db()
+        self.assertEqual((self.book.available_count, other_book.available_count), (1, 1))
+
+    def test_wishlist_email_is_sent_once(self):
+        book_cache.get_cache().clear()
+        send_wishlist_email_task(999999)  # The entry is gone: nothing to do
+        waiting = User.objects.create_user(username='waiting', email='waiting@example.com', password='pass1234')
+        entry = UserWishlist.objects.create(user=waiting, book=self.book)
+        with patch('users.models.CustomUser.send_wishlist_email', return_value=True) as send_wishlist_email:
+            send_wishlist_email_task(entry.id)
+            send_wishlist_email_task(entry.id)
+        send_wishlist_email.assert_called_once()
+
+    def test_failed_wishlist_email_is_retried(self):
+        book_cache.get_cache().clear()
+        waiting = User.objects.create_user(username='waiting', email='waiting@example.com', password='pass1234')
+        entry = UserWishlist.objects.create(user=waiting, book=self.book)
+        with patch('users.models.send_mail', side_effect=[OSError("SMTP down"), 1, 1]) as send_mail:
+            send_wishlist_email_task(entry.id)
+            send_wishlist_email_task(entry.id)
+            send_wishlist_email_task(entry.id)
+        self.assertEqual(send_mail.call_count, 2)
+
+    def test_concurrent_wishlist_emails_send_once(self):
+        book_cache.get_cache().clear()
+        waiting = User.objects.create_user(username='waiting', email='waiting@example.com', password='pass1234')
+        entry = UserWishlist.objects.create(user=waiting, book=self.book)
+
+        def send_mail(*args, **kwargs):
+            # A second task for the same entry runs while the first one is sending
+            if send_mail.calls == 0:
+                send_mail.calls += 1
+                send_wishlist_email_task(entry.id)
+            return 1
+        send_mail.calls = 0
+        with patch('users.models.send_mail', side_effect=send_mail) as mocked:
+            send_wishlist_email_task(entry.id)
+        self.assertEqual(mocked.call_count, 1)
+
+
+class HoldQueueTests(APITestBase):
+    """Tests for reserving returned copies for the wishlist queue."""
+    username = 'desk'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.first = User.objects.create_user(username='first', email='first@example.com', password='pass1234')
+        cls.second = User.objects.create_user(username='second', email='second@example.com', password='pass1234')
+
+    def setUp(self):
+        super().setUp()
+        self.book = Book.objects.create(title="Sula", library_id="LIB0000900", isbn="1234567890900")
+        self.instance = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        self.client.post('/api/books/borrow/', {'book_instance': self.instance.id}, format='json')
+        self.first_entry = UserWishlist.objects.create(user=self.first, book=self.book)
+        self.second_entry = UserWishlist.objects.create(user=self.second, book=self.book)
+
+    def _return(self):
+        return self.client.post('/api/books/return_book/', {'book_instance': self.instance.id}, format='json')
+
+    def test_returned_copy_is_held_for_the_head_of_the_queue(self):
+        self.assertEqual((self.first_entry.position, self.second_entry.position), (1, 2))
+        self._return()
+        self.instance.refresh_from_db()
+        self.first_entry.refresh_from_db()
+        self.assertEqual(self.instance.status, BookStatus.RESERVED)
+        self.assertEqual(self.first_entry.held_copy_id, self.instance.id)
+        self.assertIsNotNone(self.first_entry.hold_expires_at)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 0)
+
+        client = APIClient()
+        client.force_authenticate(user=self.second)
+        self.assertEqual(client.post(f'/api/books/{self.book.id}/borrow/').status_code, 400)
+        client.force_authenticate(user=self.first)
+        response = client.post(f'/api/books/{self.book.id}/borrow/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['book_instance']['id'], self.instance.id)
+        # Borrowing took the first user out of the queue
+        self.assertEqual(self.second_entry.position, 1)
+
+    def test_wishlist_lists_annotate_positions(self):
+        other = Book.objects.create(title="Jazz", library_id="LIB0000901", isbn="1234567890901")
+        UserWishlist.objects.create(user=self.first, book=other)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/books/{self.book.id}/wishlists_on/')
+        self.assertEqual([(entry['user'], entry['position']) for entry in response.data], [
+            (self.second.id, 2), (self.first.id, 1)
+        ])
+        self.assertEqual(len(queries), 2)  # the book and the annotated entries
+        positions = UserWishlist.objects.filter(user=self.first).with_position().values_list('book_id', 'queue_position')
+        self.assertEqual(dict(positions), {self.book.id: 1, other.id: 1})
+
+    def test_expired_hold_passes_to_the_next_in_line(self):
+        self._return()
+        UserWishlist.objects.filter(pk=self.first_entry.pk).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+        with patch('books.tasks.send_wishlist_email_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(expire_holds_task(), 1)
+        delay.assert_called_once_with(self.second_entry.id)
+        self.assertFalse(UserWishlist.objects.filter(pk=self.first_entry.pk).exists())
+        self.second_entry.refresh_from_db()
+        self.assertEqual(self.second_entry.held_copy_id, self.instance.id)
+
+        # Nobody left waiting: the copy goes back on the shelf
+        UserWishlist.objects.filter(pk=self.second_entry.pk).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+        expire_holds_task()
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.status, BookStatus.AVAILABLE)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 1)
+
+    def test_deleting_a_held_copy_keeps_the_queue_place(self):
+        self._return()
+        BookInstance.objects.get(pk=self.instance.pk).delete()
+        self.first_entry.refresh_from_db()
+        self.assertIsNone(self.first_entry.held_copy_id)
+        self.assertIsNone(self.first_entry.hold_expires_at)
+
+        # Entries left with an expiry but no copy are waiting again, not expired
+        UserWishlist.objects.filter(pk=self.first_entry.pk).update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(expire_holds_task(), 0)
+        self.first_entry.refresh_from_db()
+        self.assertIsNone(self.first_entry.hold_expires_at)
+        self.assertEqual(self.first_entry.position, 1)
+
+    def test_broker_errors_do_not_fail_the_return(self):
+        with patch('books.tasks.send_wishlist_email_task.delay', side_effect=ConnectionError("broker down")):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self._return()
+        self.assertEqual(response.status_code, 200)
+        self.first_entry.refresh_from_db()
+        self.assertEqual(self.first_entry.held_copy_id, self.instance.id)
+
+
+class OverdueReminderTests(TestCase):
+    """Tests for the periodic overdue reminder task."""
+
+    def setUp(self):
+        self.late = User.objects.create_user(username='late', email='late@example.com', password='pass1234')
+        self.prompt = User.objects.create_user(username='prompt', email='prompt@example.com', password='pass1234')
+        book = Book.objects.create(title="Paradise", library_id="LIB0001000", isbn="1234567891000")
+        past = timezone.now() - timedelta(days=1)
+        for i in range(5):
+            copy = BookInstance.objects.create(book=book, status=BookStatus.BORROWED)
+            BookInstanceHistory.objects.create(
+                book_instance=copy, user=self.late, status=BookStatus.BORROWED,
+                borrowed_date=past - timedelta(days=14), due_date=past - timedelta(days=i), is_returned=False
+            )
+        copy = BookInstance.objects.create(book=book, status=BookStatus.BORROWED)
+        BookInstanceHistory.objects.create(
+            book_instance=copy, user=self.prompt, status=BookStatus.BORROWED,
+            borrowed_date=timezone.now(), due_date=timezone.now() + timedelta(days=14), is_returned=False
+        )
+
+    def test_one_reminder_per_user_and_reruns_send_nothing(self):
+        with patch('books.tasks.send_overdue_reminder_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                # A batch smaller than the user's loans still yields one message
+                result = send_overdue_reminders_task(batch_size=2)
+        self.assertEqual(result, {'users': 1, 'loans': 5})
+        delay.assert_called_once()
+        self.assertEqual(delay.call_args.args[0], self.late.id)
+        self.assertEqual(len(delay.call_args.args[1]), 5)
+
+        # Loans are only stamped once their email is sent
+        self.assertFalse(BookInstanceHistory.objects.filter(reminder_sent_at__isnull=False).exists())
+        with patch('users.models.send_mail') as send_mail, \
+                patch('books.tasks.send_overdue_reminder_task.delay', side_effect=send_overdue_reminder_task):
+            with self.captureOnCommitCallbacks(execute=True):
+                send_overdue_reminders_task()
+        send_mail.assert_called_once()
+        with patch('books.tasks.send_overdue_reminder_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(send_overdue_reminders_task(), {'users': 0, 'loans': 0})
+        delay.assert_not_called()
+
+    def test_failed_reminders_are_retried(self):
+        loan_ids = list(BookInstanceHistory.objects.filter(user=self.late).values_list('id', flat=True))
+        with patch('users.models.send_mail', side_effect=OSError("SMTP down")):
+            send_overdue_reminder_task(self.late.id, loan_ids)
+        self.assertFalse(BookInstanceHistory.objects.filter(reminder_sent_at__isnull=False).exists())
+        with patch('books.tasks.send_overdue_reminder_task.delay', side_effect=[ConnectionError("broker down")]) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(send_overdue_reminders_task(), {'users': 1, 'loans': 5})
+        delay.assert_called_once()
+        with patch('users.models.send_mail') as send_mail:
+            send_overdue_reminder_task(self.late.id, loan_ids)
+            send_overdue_reminder_task(self.late.id, loan_ids)
+        send_mail.assert_called_once()
+        self.assertEqual(BookInstanceHistory.objects.filter(reminder_sent_at__isnull=False).count(), 5)
+
+    def test_loans_superseded_by_later_history_are_skipped(self):
+        # A return row written by the old return path, which left the loan open
+        for loan in BookInstanceHistory.objects.filter(user=self.late):
+            BookInstanceHistory.objects.create(
+                book_instance_id=loan.book_instance_id, user=self.late, status=BookStatus.AVAILABLE,
+                returned_date=loan.due_date, is_returned=True
+            )
+        with patch('books.tasks.send_overdue_reminder_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(send_overdue_reminders_task(), {'users': 0, 'loans': 0})
+        delay.assert_not_called()
+
+    def test_reminder_lists_every_overdue_book(self):
+        loan_ids = list(BookInstanceHistory.objects.filter(user=self.late).values_list('id', flat=True))
+        with patch('users.models.send_mail') as send_mail:
+            send_overdue_reminder_task(self.late.id, loan_ids)
+        send_mail.assert_called_once()
+        self.assertEqual(send_mail.call_args.args[1].count('Paradise'), 5)
+
+
+class HistoryArchiveTests(APITestBase):
+    """Tests for archiving closed loan history."""
+    username = 'archivist'
+    is_staff = True
+
+    def setUp(self):
+        super().setUp()
+        self.book = Book.objects.create(title="Tar Baby", library_id="LIB0001100", isbn="1234567891100")
+        self.copy = BookInstance.objects.create(book=self.book, status=BookStatus.AVAILABLE)
+        # A loan returned two years ago, as a borrow row and a return row
+        borrowed = timezone.now() - timedelta(days=730)
+        returned = borrowed + timedelta(days=10)
+        self.old_loan = BookInstanceHistory.objects.create(
+            book_instance=self.copy, user=self.user, status=BookStatus.BORROWED, borrowed_date=borrowed,
+            due_date=borrowed + timedelta(days=14), returned_date=returned, is_returned=True
+        )
+        BookInstanceHistory.objects.create(
+            book_instance=self.copy, user=self.user, status=BookStatus.AVAILABLE, returned_date=returned, is_returned=True
+        )
+        # A current loan stays in the hot table
+        self.client.post('/api/books/borrow/', {'book_instance': self.copy.id}, format='json')
+
+    def _history_report(self, **params):
+        response = self.client.get('/api/books/report/history/', params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))['report']
+
+    def test_archive_moves_closed_history_and_reports_union_it(self):
+        out = StringIO()
+        call_command('archive_history', '--days', '365', '--batch-size', '1', stdout=out)
+        self.assertIn('Moved 2 history rows into 2 archive records', out.getvalue())
+        self.assertEqual(BookInstanceHistory.objects.count(), 1)
+        archived = BookInstanceHistoryArchive.objects.get(pk=self.old_loan.pk)
+        self.assertEqual(archived.book_id, self.book.id)
+        self.assertEqual(archived.returned_date, self.old_loan.returned_date)
+
+        report = self._history_report(borrowed_from='2000-01-01')
+        self.assertEqual([row['loan_id'] for row in report][0], self.old_loan.pk)
+        self.assertEqual(len(report), 2)
+        self.assertEqual(report[0]['book_title'], "Tar Baby")
+        # A range inside the hot window does not need the archive
+        self.assertEqual(len(self._history_report(borrowed_from=timezone.localdate().isoformat())), 1)
+
+    def test_compaction_keeps_one_record_per_loan(self):
+        moved, archived = archive_history(older_than=timedelta(days=365), compact=True)
+        self.assertEqual((moved, archived), (2, 1))
+        self.assertEqual(list(BookInstanceHistoryArchive.objects.values_list('id', flat=True)), [self.old_loan.pk])
+
+
+class BulkImportTests(TestCase):
+    """Tests for the set-based CSV import."""
+
+    def setUp(self):
+        self.author = Author.objects.create(given_names="Toni", surname="Morrison")
+        self.existing = Book.objects.create(title="Sula", library_id="0000000001", isbn="9780000000001")
+
+    @staticmethod
+    def _row(number, **fields):
+        row = {
+            'library_id': f"{number:010d}",
+            'isbn': f"{9780000000000 + number}",
+            'title': f"Book {number}",
+            'authors': "Toni Morrison, Ann Other",
+            'publication_year': 1990,
+            'language': 'en',
+        }
+        row.update(fields)
+        return row
+
+    def test_import_creates_updates_and_reports_rows(self):
+        imported, errors = import_rows([
+            (1, self._row(1, title="Sula (reissue)")),
+            (2, self._row(2)),
+            (3, self._row(3, library_id="bad")),
+            (4, self._row(4, isbn="9780000000002")),
+        ])
+        self.assertEqual(imported, 2)
+        self.assertEqual([error['row'] for error in errors], [3, 4])
+        self.assertIn('library_id', errors[0]['errors'])
+        self.assertIn('isbn', errors[1]['errors'])
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.title, "Sula (reissue)")
+        created = Book.objects.get(library_id="0000000002")
+        self.assertEqual(created.language, "English")
+        self.assertTrue(created.slug)
+        self.assertEqual(Author.objects.filter(surname="Morrison").count(), 1)
+        self.assertEqual(set(created.authors.values_list('surname', flat=True)), {"Morrison", "Other"})
+        for book in (self.existing, created):
+            book.refresh_from_db()
+            self.assertEqual(book.book_instances.count(), 1)
+            self.assertEqual((book.copy_count, book.available_count), (1, 1))
+            self.assertEqual(BookInstanceHistory.objects.filter(book_instance__book=book).count(), 1)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        import_rows([(9, self._row(9))])  # creates the authors
+        with CaptureQueriesContext(connection) as small:
+            import_rows([(n, self._row(n)) for n in range(10, 12)])
+        with CaptureQueriesContext(connection) as large:
+            import_rows([(n, self._row(n)) for n in range(20, 60)])
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Book.objects.count(), 44)
+
+    def test_csv_task_imports_file(self):
+        content = (
+            "id,title,authors,isbn,publication year,language\n"
+            "5,Beloved,Toni Morrison,9781400033416,1987,en\n"
+            "6,,Toni Morrison,9780452264465,1977,en\n"
+            "7,Jazz,Toni Morrison,9780679411673,not a year,en\n"
+        )
+        path = default_storage.save('imports/test_books.csv', ContentFile(content))
+        with patch.object(process_csv_task, 'update_state') as update_state:
+            results = process_csv_task.apply(args=[path]).get()
+        update_state.assert_called_once_with(state='PROGRESS', meta={"processed": 3, "success": 1, "errors": 1})
+        self.assertEqual(results['total_processed'], 3)
+        self.assertEqual(results['success'], 1)
+        self.assertEqual([error['row'] for error in results['errors']], ["", 3])
+        self.assertTrue(Book.objects.filter(library_id="0000000005", title="Beloved").exists())
+        self.assertFalse(default_storage.exists(path))
+
+    def test_upload_status_reports_task_state(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(
+            username='uploader', email='uploader@example.com', password='pass1234'
+        ))
+        upload = SimpleUploadedFile("books.csv", b"id,title,authors,isbn,publication year,language\n")
+        with patch('books.views.process_csv_task.delay') as delay, patch('books.views.default_storage.save'):
+            delay.return_value.id = 'abc-123'
+            client.post('/api/books/upload_csv/', {'file': upload}, format='multipart')
+        progress = {"processed": 500, "success": 498, "errors": 2}
+        with patch('books.views.process_csv_task.AsyncResult') as async_result:
+            async_result.return_value.state = 'PROGRESS'
+            async_result.return_value.info = progress
+            response = client.get('/api/books/upload_csv/abc-123/')
+        async_result.assert_called_once_with('abc-123')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'task_id': 'abc-123', 'state': 'PROGRESS', 'info': progress})
+        with patch('books.views.process_csv_task.AsyncResult') as async_result:
+            async_result.return_value.state = 'FAILURE'
+            async_result.return_value.info = ValueError("The file is empty")
+            response = client.get('/api/books/upload_csv/abc-123/')
+        self.assertEqual(response.data['info'], {'error': "The file is empty"})
+
+        # Other users cannot read the results of someone else's upload
+        client.force_authenticate(user=User.objects.create_user(
+            username='other', email='other@example.com', password='pass1234'
+        ))
+        with patch('books.views.process_csv_task.AsyncResult') as async_result:
+            response = client.get('/api/books/upload_csv/abc-123/')
+        self.assertEqual(response.status_code, 404)
+        async_result.assert_not_called()
+
+    def test_read_chunks_cleans_each_chunk(self):
+        content = StringIO(
+            "ID,Title,Authors,ISBN,Publication Year,Language\n"
+            "1,Sula,,0345391802,1973, EN\n"
+            "2,,Toni Morrison,9780000000002,1977,en\n"
+            "3,Jazz,Toni Morrison,9780000000003,1992,en\n"
+        )
+        chunks = list(read_chunks(content, chunksize=2))
+        self.assertEqual([dropped for _, dropped in chunks], [1, 0])
+        first, second = chunks[0][0], chunks[1][0]
+        self.assertEqual(list(second.index), [2])
+        row = first.to_dict('records')[0]
+        self.assertEqual(row['library_id'], "0000000001")
+        self.assertEqual(row['isbn'], "0345391802")
+        self.assertEqual((row['authors'], row['language'], row['publication_year']), ("Unknown", "en", "1973"))
+
+    def test_validate_chunk_sets_invalid_rows_aside(self):
+        chunk = pd.DataFrame({
+            'library_id': ["0000000011", "0000000012", "0000000011", "short", "0000000014"],
+            'isbn': ["0345391802", "9780345391803", "9780306406157", "9780306406157", "9780306406158"],
+            'language': ["en", "fr", "en", "en", "en"],
+        }, index=[0, 1, 2, 3, 4])
+        clean, errors = validate_chunk(chunk)
+        self.assertEqual(list(clean.index), [0])
+        self.assertEqual(clean.loc[0, 'isbn'], "9780345391803")
+        self.assertEqual(clean.loc[0, 'language'], "English")
+        self.assertEqual(errors, [
+            {"row": 2, "errors": {"isbn": ["Duplicate of row 1."]}},
+            {"row": 3, "errors": {"library_id": ["Duplicate of row 1."]}},
+            {"row": 4, "errors": {"library_id": ["Invalid Library ID format."]}},
+            {"row": 5, "errors": {"isbn": ["Invalid ISBN checksum."]}},
+        ])
+        # Repeats of earlier chunks are left to the database lookup in import_rows
+        later = pd.DataFrame({'library_id': ["0000000011"], 'isbn': ["9780306406157"], 'language': ["en"]}, index=[5])
+        clean, errors = validate_chunk(later)
+        self.assertEqual((list(clean.index), errors), ([5], []))
+
+    def test_normalize_isbns_rejects_non_ascii_digits(self):
+        isbns = pd.Series(["\u0660\u0663\u0664\u0665\u0663\u0669\u0661\u0668\u0660\u0662", "0345391802"])
+        normalized, problems = normalize_isbns(isbns)
+        self.assertEqual(problems[0], "Invalid ISBN format.")
+        self.assertTrue(pd.isna(problems[1]))
+        self.assertEqual(normalized[1], "9780345391803")
+
+
+class AuthorResolverTests(TestCase):
+    """Tests for resolving imported author names."""
+
+    def test_matches_normalized_names_and_inserts_missing(self):
+        morrison = Author.objects.create(given_names="Toni", surname="Morrison")
+        resolver = AuthorResolver()
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = resolver.resolve(["toni  MORRISON", "Ann Other", "Plato"])
+        self.assertEqual(ids["toni  MORRISON"], morrison.pk)
+        other = Author.objects.get(pk=ids["Ann Other"])
+        self.assertEqual((other.given_names, other.surname, other.slug), ("Ann", "Other", "ann-other"))
+        self.assertEqual(Author.objects.get(pk=ids["Plato"]).given_names, "")
+
+        # Later chunks are served from the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve(["Ann  Other"]), {"Ann  Other": other.pk})
+
+    def test_taken_slug_gets_a_qualified_one(self):
+        Author.objects.create(given_names="Jean-Paul", surname="Sartre")  # slug jean-paul-sartre
+        ids = AuthorResolver().resolve(["Jean Paul-Sartre", "Jean Paul-Sartre"])
+        author = Author.objects.get(pk=ids["Jean Paul-Sartre"])
+        self.assertEqual(author.slug, author_slug("Jean", "Paul-Sartre", qualified=True))
+        self.assertEqual(Author.objects.count(), 2)
+        # Resolving again, as a concurrent import would, finds the same row
+        self.assertEqual(AuthorResolver().resolve(["jean paul-sartre"])["jean paul-sartre"], author.pk)
+
+    def test_cache_keeps_the_most_recently_used(self):
+        resolver = AuthorResolver(maxsize=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            resolver.resolve(["A One", "B Two"])
+        with self.captureOnCommitCallbacks(execute=True):
+            resolver.resolve(["A One"])
+            resolver.resolve(["C Three"])
+        self.assertEqual([key for key in resolver._ids], [("a", "one"), ("c", "three")])
@@ -12,19 +12,33 @@ from datetime import timedelta
 from django_filters.rest_framework import DjangoFilterBackend
 import logging
 
+from .facets import get_facets
+from .filters import BookFilter
+from .loans import borrow_any_copy, borrow_copies, borrow_copy, return_copies, return_copy
 from .models import Author, Book, BookStatus, BookInstance, BookInstanceHistory
 from .serializers import (
-    BookSerializer, BookSearchSerializer, BookBorrowSerializer,
-    AuthorSerializer
+    BookSerializer, BookSearchSerializer, BookBorrowSerializer, BookBulkLoanSerializer,
+    BookAutocompleteSerializer, BookInstanceSerializer, BorrowedReportSerializer,
+    LoanHistoryReportSerializer, AuthorSerializer
 )
-from .tasks import process_csv_task, process_amazon_ids_task
+from . import cache as book_cache, fuzzy
+from .autocomplete import index as autocomplete_index
+from .mixins import CachedResponseMixin, ConditionalGetMixin
+from .reports import borrowed_report_response, loan_history_response
+from .search import search_books
+from .tasks import process_csv_task, process_amazon_ids_task, notify_holders
 
 from users.models import UserWishlist
 from users.serializers import UserWishlistSerializer
 
 logger = logging.getLogger(__name__)
 
-class AuthorViewSet(viewsets.ModelViewSet):
+
+def _upload_owner_key(task_id):
+    return f'books:upload:{task_id}:owner'
+
+
+class AuthorViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing authors.
     """
@@ -35,7 +49,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
     search_fields = ['given_names', 'surname']
     filterset_fields = ['given_names', 'surname']
     ordering_fields = ['given_names', 'surname']
-    ordering = ['given_names', 'surname']
+    ordering = ['surname', 'given_names']
     
     def get_permissions(self):
         """
@@ -45,7 +59,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
             return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticated()]
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows books to be viewed or edited.
     """
@@ -54,8 +68,8 @@ class BookViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter]
     search_fields = ['title', 'authors', 'isbn', 'amazon_id']
-    filterset_fields = ['language']
-    ordering_fields = ['title', 'authors', 'publication_date', 'created_at']
+    filterset_class = BookFilter
+    ordering_fields = ['title', 'created_at', 'available_count']
     ordering = ['title']
 
     def get_permissions(self):
@@ -65,20 +79,58 @@ class BookViewSet(viewsets.ModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy', 'update_amazon_ids']:
             return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticated()]
+
+    def validator_cache_key(self, request, pk=None):
+        # Every write to a book bumps the versions in this key, as for the cached responses.
+        return book_cache.validators_key(request, pk)
+
+    def get_queryset(self):
+        """
+        Prefetch authors and instances for reads, so a page of books costs a
+        constant number of queries. Copy counts are stored on Book. Relations
+        whose fields were not requested with ``?fields=``/``?expand=`` are skipped.
+        """
+        queryset = super().get_queryset()
+        if self.action not in ['list', 'retrieve', 'search']:
+            return queryset
+        fields = self.get_serializer_class().selected_fields(self.request.query_params)
+        prefetch = []
+        if 'authors_display' in fields:
+            prefetch.append('authors')
+        if 'book_instances' in fields:
+            prefetch.append('book_instances')
+        return queryset.prefetch_related(*prefetch)
+
+    def paginate_queryset(self, queryset):
+        # Keep the filtered, unpaginated queryset for the facet counts.
+        self.facet_queryset = queryset
+        return super().paginate_queryset(queryset)
+
+    def get_paginated_response(self, data):
+        """
+        Add counts by language, decade and availability over all matching books.
+        """
+        response = super().get_paginated_response(data)
+        response.data['facets'] = get_facets(self.request, self.facet_queryset)
+        return response
         
     @action(detail=False, methods=['get'])
     def search(self, request):
         """
-        Search for books by title or authors.
+        Search for books by title or authors, best matches first.
+        Pass ``mode=fuzzy`` to tolerate misspellings.
         """
         serializer = BookSearchSerializer(data=request.query_params)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         query = serializer.validated_data['query']
-        books = Book.objects.filter(
-            Q(title__icontains=query) | Q(authors__given_names__icontains=query) | Q(authors__surname__icontains=query)
-        )
+        # Apply the list filters too, so results and facets match the filters.
+        queryset = self.filter_queryset(self.get_queryset())
+        if serializer.validated_data['mode'] == 'fuzzy':
+            books = fuzzy.search_books(queryset, query)
+        else:
+            books = search_books(queryset, query)
         
         page = self.paginate_queryset(books)
         if page is not None:
@@ -88,6 +140,18 @@ class BookViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(books, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Suggest titles and author names starting with ``q``, from an in-memory index.
+        """
+        serializer = BookAutocompleteSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        results = autocomplete_index.complete(serializer.validated_data['q'], serializer.validated_data['limit'])
+        return Response({'results': results})
+    
     @action(detail=False, methods=['post'], parser_classes=[JSONParser, FormParser, MultiPartParser])
     def borrow(self, request):
         """
@@ -104,30 +168,9 @@ class BookViewSet(viewsets.ModelViewSet):
             book_instance = serializer.validated_data['book_instance']
             logger.info(f"Processing borrow request for book instance: {book_instance.id}")
             
-            # Check if book is already borrowed
-            if book_instance.status == BookStatus.BORROWED:
-                logger.warning(f"Book instance {book_instance.id} is already borrowed")
-                return Response(
-                    {'error': 'This book is already borrowed'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Update Book Instance
-            book_instance.status = BookStatus.BORROWED
-            
+            # Flip the status and open the loan in one conditional transition
             try:
-                # Create new entry in BookInstanceHistory
-                history = BookInstanceHistory(
-                    book_instance=book_instance,
-                    status=BookStatus.BORROWED,
-                    user=request.user,
-                    borrowed_date=timezone.now(),
-                    due_date=timezone.now() + timedelta(days=14),
-                    is_returned=False
-                )
-                history.save()
-                book_instance.save()
-                logger.info(f"Successfully updated book instance {book_instance.id} and created history entry")
+                loan = borrow_copy(book_instance, request.user)
             except Exception as e:
                 logger.error(
                     f"Error updating book instance {book_instance.id} or creating history: {str(e)}",
@@ -137,21 +180,15 @@ class BookViewSet(viewsets.ModelViewSet):
                     {'error': 'Failed to update book status'}, 
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
-            
-            # Delete UserWishlist instance if it exists
-            try:
-                deleted_count, _ = UserWishlist.objects.filter(
-                    book=book_instance.book, 
-                    user=request.user
-                ).delete()
-                if deleted_count > 0:
-                    logger.info(f"Removed {deleted_count} items from user's wishlist")
-            except Exception as e:
-                logger.error(
-                    f"Error removing book from user's wishlist: {str(e)}",
-                    exc_info=True
+            if loan is None:
+                logger.warning(f"Book instance {book_instance.id} is not available")
+                return Response(
+                    {'error': 'This book is already borrowed'}, 
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                # Don't fail the request if wishlist cleanup fails
+            logger.info(f"Successfully updated book instance {book_instance.id} and created history entry")
+            
+            self._remove_from_wishlist([book_instance.book_id], request.user)
             
             logger.info(f"Successfully processed borrow request for book instance {book_instance.id}")
             return Response(
@@ -169,6 +206,58 @@ class BookViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=True, methods=['post'], url_path='borrow', url_name='borrow_any')
+    def borrow_any(self, request, pk=None):
+        """
+        Borrow any available copy of this book and return the copy claimed.
+        """
+        book = self.get_object()
+        try:
+            book_instance, loan = borrow_any_copy(book, request.user)
+        except Exception as e:
+            logger.error(
+                f"Error borrowing a copy of book {book.id}: {str(e)}",
+                exc_info=True
+            )
+            return Response(
+                {'error': 'Failed to update book status'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        if book_instance is None:
+            return Response(
+                {'error': 'No copies of this book are available'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        self._remove_from_wishlist([book.id], request.user)
+        logger.info(f"Borrowed book instance {book_instance.id} of book {book.id}")
+        return Response(
+            {
+                'message': 'Book borrowed successfully!',
+                'book_instance': BookInstanceSerializer(book_instance).data,
+                'due_date': loan.due_date,
+            },
+            status=status.HTTP_200_OK
+        )
+
+    def _remove_from_wishlist(self, book_ids, user):
+        """
+        Delete the borrower's wishlist entries for books they have just borrowed.
+        """
+        try:
+            deleted_count, _ = UserWishlist.objects.filter(
+                book_id__in=book_ids, 
+                user=user
+            ).delete()
+            if deleted_count > 0:
+                logger.info(f"Removed {deleted_count} items from user's wishlist")
+        except Exception as e:
+            logger.error(
+                f"Error removing book from user's wishlist: {str(e)}",
+                exc_info=True
+            )
+            # Don't fail the request if wishlist cleanup fails
+    
     @action(detail=False, methods=['post'], parser_classes=[JSONParser, FormParser, MultiPartParser])
     def return_book(self, request):
         """
@@ -183,22 +272,9 @@ class BookViewSet(viewsets.ModelViewSet):
 
             book_instance = serializer.validated_data['book_instance']
 
-            book = book_instance.book
-            available_copies = book.available_copies
-
-            book_instance.status = BookStatus.AVAILABLE
-            book_instance.save()
-
-            # Update Book Instance History
+            # Flip the status and close the loan in one conditional transition
             try:
-                history = BookInstanceHistory.objects.create(
-                    book_instance=book_instance,
-                    status=BookStatus.AVAILABLE,
-                    user=request.user,
-                    returned_date=timezone.now(),
-                    is_returned=True
-                )
-                history.save()
+                returned, hold = return_copy(book_instance, request.user)
             except Exception as e:
                 logger.error(
                     f"Error updating book instance history: {str(e)}",
@@ -208,10 +284,12 @@ class BookViewSet(viewsets.ModelViewSet):
                     {'error': 'Failed to update book instance history'}, 
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
+            if not returned:
+                return Response({'error': 'This book is not borrowed'}, status=status.HTTP_400_BAD_REQUEST)
             
-            # If available copies was 0, and is now 1, send email to next user on wishlist
-            if available_copies == 0 and book.available_copies == 1:
-                UserWishlist.objects.filter(book=book).first().user.send_wishlist_email(book)
+            # Let the user at the head of the hold queue know the copy is held for them
+            if hold is not None:
+                notify_holders([hold])
 
             return Response({'message': 'Book returned successfully!'}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -221,6 +299,71 @@ class BookViewSet(viewsets.ModelViewSet):
             )
             return Response({'error': 'An unexpected error occurred'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'])
+    def bulk_borrow(self, request):
+        """
+        Borrow several copies at once.
+        """
+        serializer = BookBulkLoanSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        instance_ids = serializer.validated_data['book_instances']
+
+        try:
+            outcomes, borrowed, due_date = borrow_copies(instance_ids, request.user)
+        except Exception as e:
+            logger.error(f"Error in bulk borrow of {instance_ids}: {str(e)}", exc_info=True)
+            return Response(
+                {'error': 'Failed to update book status'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        if borrowed:
+            self._remove_from_wishlist(set(borrowed.values()), request.user)
+        logger.info(f"Bulk borrowed {len(borrowed)} of {len(outcomes)} book instances")
+        return Response(
+            {
+                'borrowed': len(borrowed),
+                'due_date': due_date if borrowed else None,
+                'results': [
+                    {'book_instance': pk, 'status': outcome} for pk, outcome in outcomes.items()
+                ],
+            },
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['post'])
+    def bulk_return(self, request):
+        """
+        Return several copies at once.
+        """
+        serializer = BookBulkLoanSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        instance_ids = serializer.validated_data['book_instances']
+
+        try:
+            outcomes, holds = return_copies(instance_ids, request.user)
+        except Exception as e:
+            logger.error(f"Error in bulk return of {instance_ids}: {str(e)}", exc_info=True)
+            return Response(
+                {'error': 'Failed to update book instance history'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        notify_holders(holds)
+        returned = sum(1 for outcome in outcomes.values() if outcome == 'returned')
+        logger.info(f"Bulk returned {returned} of {len(outcomes)} book instances")
+        return Response(
+            {
+                'returned': returned,
+                'results': [
+                    {'book_instance': pk, 'status': outcome} for pk, outcome in outcomes.items()
+                ],
+            },
+            status=status.HTTP_200_OK
+        )
+
     @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def upload_csv(self, request):
         """
@@ -235,8 +378,28 @@ class BookViewSet(viewsets.ModelViewSet):
             return Response({'error': 'File is not a CSV'}, status=status.HTTP_400_BAD_REQUEST)
 
         path = default_storage.save(f'uploads/{file.name}', file)
-        process_csv_task.delay(path, 'test@email.com')
-        return Response({"message": "File successfully uploaded. You will receive an email when this file has finished processing."}, status=202)
+        task = process_csv_task.delay(path, 'test@email.com')
+        # The task result holds the rejected rows, so only the uploader may read it.
+        book_cache.get_cache().set(
+            _upload_owner_key(task.id), request.user.pk,
+            timeout=getattr(settings, 'CSV_UPLOAD_OWNER_TIMEOUT', 7 * 24 * 60 * 60)
+        )
+        return Response({"message": "File successfully uploaded. You will receive an email when this file has finished processing.", "task_id": task.id}, status=202)
+
+    @action(detail=False, methods=['get'], url_path=r'upload_csv/(?P<task_id>[^/]+)', url_name='upload_csv_status')
+    def upload_csv_status(self, request, task_id=None):
+        """
+        Report the state of a CSV import: its progress counts while it runs,
+        its results once done, or its error if it failed. Only the user who
+        uploaded the file, or staff, may read it.
+        """
+        if not request.user.is_staff and book_cache.get_cache().get(_upload_owner_key(task_id)) != request.user.pk:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        result = process_csv_task.AsyncResult(task_id)
+        info = result.info
+        if isinstance(info, Exception):
+            info = {'error': str(info)}
+        return Response({'task_id': task_id, 'state': result.state, 'info': info})
     
     @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
     def update_amazon_ids(self, request):
@@ -249,27 +412,22 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='report', url_name='generate_borrowed_report', permission_classes=[permissions.IsAdminUser])
     def generate_borrowed_report(self, request):
         """
-        Generate a report on all bookinstances that are currently borrowed.
+        Stream a report on all bookinstances that are currently borrowed.
         """
-        borrowed_bookinstances = BookInstance.objects.filter(status=BookStatus.BORROWED).select_related('book')
-        
-        report = []
-        for bookinstance in borrowed_bookinstances:
-            history = bookinstance.history.order_by('-borrowed_date').first()
-            report.append({
-                'book_title': bookinstance.book.title,
-                'book_id': bookinstance.book.id,
-                'bookinstance_id': bookinstance.id,
-                'book_status': bookinstance.status,
-                'borrower': history.user.username,
-                'borrowed_date': history.borrowed_date,
-                'due_date': history.due_date,
-            })
-        
-        return Response({
-            'message': 'Report generated',
-            'report': report
-        })
+        serializer = BorrowedReportSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return borrowed_report_response(**serializer.validated_data)
+
+    @action(detail=False, methods=['get'], url_path='report/history', url_name='loan_history_report', permission_classes=[permissions.IsAdminUser])
+    def loan_history_report(self, request):
+        """
+        Stream every loan borrowed in a date range, including archived loans.
+        """
+        serializer = LoanHistoryReportSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return loan_history_response(**serializer.validated_data)
 
     @action(detail=True, methods=['post'])
     def create_new_copy(self, request, pk=None):
@@ -317,7 +475,7 @@ class BookViewSet(viewsets.ModelViewSet):
         """
         try:
             book = self.get_object()
-            wishlists = UserWishlist.objects.filter(book=book).prefetch_related('user')
+            wishlists = UserWishlist.objects.filter(book=book).with_position().select_related('user', 'book')
             serializer = UserWishlistSerializer(wishlists, many=True)
             return Response(serializer.data)
         except Exception as e:
@@ -0,0 +1,185 @@
+"""
+Keyset (cursor) pagination for the API list endpoints.
+
+Pages are selected with a ``WHERE (a, b, id) > (x, y, z)`` style filter on the
+queryset's ordering instead of ``OFFSET``, so fetching a deep page costs the
+same as the first one. The primary key is appended to the ordering as a tie
+breaker so every row has a unique position. The total ``count`` is only
+computed when the client asks for it with ``?count=true``.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+from decimal import Decimal
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = api_settings.PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        """Return the queryset's ordering with the primary key appended as a tie breaker."""
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        ordering = [field for field in ordering if isinstance(field, str)] or ['pk']
+        names = {field.lstrip('-') for field in ordering}
+        if not names & {'pk', 'id', queryset.model._meta.pk.name}:
+            ordering.append('-pk' if ordering[0].startswith('-') else 'pk')
+        return ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            return bool(cursor['r']), list(cursor['v'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, reverse, values):
+        cursor = json.dumps({'r': int(reverse), 'v': [_encode_value(value) for value in values]})
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+        )
+
+    def keyset_filter(self, ordering, values, reverse):
+        """Build ``(f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...`` for the given position."""
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            condition |= equal & Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def position(self, obj, ordering):
+        values = []
+        for field in ordering:
+            value = obj
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    def fetch(self, queryset, ordering, cursor, reverse, limit):
+        """The first ``limit`` rows after the cursor, in the order they are paged through."""
+        if reverse:
+            queryset = queryset.order_by(*[f[1:] if f.startswith('-') else f'-{f}' for f in ordering])
+        else:
+            queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, cursor[1], reverse))
+        return list(queryset[:limit])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        page_size = self.get_page_size(request)
+        ordering = self.get_ordering(queryset)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[0]
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+
+        results = self.fetch(queryset, ordering, cursor, reverse, page_size + 1)
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next = self.previous = None
+        if results:
+            first, last = self.position(results[0], ordering), self.position(results[-1], ordering)
+            if has_more or reverse:
+                self.next = self.encode_cursor(False, last)
+            if cursor is not None and (has_more or not reverse):
+                self.previous = self.encode_cursor(True, first)
+        return results
+
+    def get_paginated_response(self, data):
+        response = {'next': self.next, 'previous': self.previous}
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': 'Only present with ?count=true'},
+                'results': schema,
+            },
+        }
+
+
+class ArchiveKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination over a hot table and its archive table.
+
+    The view provides ``get_archive_queryset()`` and ``archive_horizon()``.
+    Archived rows keep their primary keys and sort before the horizon on the
+    first ordering field. A page that ends after the horizon is read from the
+    hot table alone, and only pages reaching past it also read the archive.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.archive = view.get_archive_queryset() if view is not None else None
+        self.horizon = view.archive_horizon() if self.archive is not None else None
+        results = super().paginate_queryset(queryset, request, view)
+        if self.count is not None and self.archive is not None:
+            self.count += self.archive.count()
+        return results
+
+    def reaches_archive(self, results, ordering, reverse, limit):
+        """Whether rows from the archive could belong among ``results``."""
+        if ordering[0].startswith('-') == reverse or len(results) < limit:
+            return True
+        return self.position(results[-1], ordering[:1])[0] < self.horizon
+
+    def fetch(self, queryset, ordering, cursor, reverse, limit):
+        results = super().fetch(queryset, ordering, cursor, reverse, limit)
+        if self.archive is None or not self.reaches_archive(results, ordering, reverse, limit):
+            return results
+        results += super().fetch(self.archive, ordering, cursor, reverse, limit)
+        for field in reversed(ordering):
+            results.sort(
+                key=lambda obj: self.position(obj, [field])[0],
+                reverse=field.startswith('-') != reverse
+            )
+        return results[:limit]
@@ -123,7 +123,8 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Keyset pagination on each view's ordering; pass ?count=true for a total.
+    'DEFAULT_PAGINATION_CLASS': 'library.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
 }
 
@@ -249,6 +250,29 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache
+# Redis in production; a per-process locmem cache otherwise (development and tests).
+if 'REDIS_CACHE_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cache used for book list/detail responses, and how long entries live in seconds.
+BOOK_CACHE_ALIAS = 'default'
+BOOK_CACHE_TIMEOUT = int(os.environ.get('BOOK_CACHE_TIMEOUT', 300))
+
+# Seconds between checks of whether another process changed the autocomplete index.
+AUTOCOMPLETE_CHECK_INTERVAL = 5
+
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
@@ -256,6 +280,30 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Periodic tasks are stored by django_celery_beat; these entries are synced into it.
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'expire-holds': {
+        'task': 'books.tasks.expire_holds_task',
+        'schedule': 15 * 60,
+    },
+    'send-overdue-reminders': {
+        'task': 'books.tasks.send_overdue_reminders_task',
+        'schedule': 60 * 60,
+    },
+    'archive-history': {
+        'task': 'books.tasks.archive_history_task',
+        'schedule': 24 * 60 * 60,
+    },
+}
+
+# Closed loan history older than this moves to the archive table; see books.archive.
+HISTORY_ARCHIVE_AFTER_DAYS = int(os.environ.get('HISTORY_ARCHIVE_AFTER_DAYS', 365))
+# Keep one archive record per loan instead of separate borrow and return rows.
+HISTORY_ARCHIVE_COMPACT = os.environ.get('HISTORY_ARCHIVE_COMPACT', 'false').lower() == 'true'
+
+# Seconds during which a user is not emailed again about the same wishlist book.
+WISHLIST_EMAIL_DEDUP_TIMEOUT = 24 * 60 * 60
 
 # Email settings for Celery
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For development
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -25,12 +26,19 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
-    def send_wishlist_email(self, book):
-        """Send an email to the user when a book they have on their wishlist becomes available."""
+    def send_wishlist_email(self, book, hold_expires_at=None):
+        """
+        Send an email to the user when a book they have on their wishlist
+        becomes available. Returns whether it was sent.
+        """
         try:
             # Create the email message
             subject = 'Your wishlist book is available!'
-            message = f"Hello {self.username},\n\nYour wishlist book {book.title} is now available for borrowing.\n\nBest regards,\nLibrary Team"
+            if hold_expires_at is not None:
+                availability = f"A copy is being held for you until {hold_expires_at:%d %B %Y %H:%M}."
+            else:
+                availability = "It is now available for borrowing."
+            message = f"Hello {self.username},\n\nYour wishlist book {book.title} is back. {availability}\n\nBest regards,\nLibrary Team"
             from_email = 'library@example.com'
             recipient_list = [self.email]
             
@@ -44,14 +52,51 @@ class CustomUser(AbstractUser):
             )            
             # Log the email sending
             logger.info(f"Sent wishlist email to {self.email}")
+            return True
 
         except Exception as e:
             logger.error(
                 f"Failed to send wishlist email to {self.email}: {str(e)}",
                 exc_info=True
             )
+            return False
+
+    def send_overdue_email(self, loans):
+        """Send one email to the user listing their overdue loans. Returns whether it was sent."""
+        try:
+            lines = '\n'.join(
+                f"- {loan.book_instance.book.title} (due {loan.due_date:%d %B %Y})" for loan in loans
+            )
+            subject = 'Your library books are overdue'
+            message = f"Hello {self.username},\n\nThe following books are overdue:\n\n{lines}\n\nPlease return them as soon as possible.\n\nBest regards,\nLibrary Team"
+            send_mail(
+                subject,
+                message,
+                'library@example.com',
+                [self.email],
+                fail_silently=False,
+            )
+            logger.info(f"Sent overdue email for {len(loans)} loans to {self.email}")
+            return True
+
+        except Exception as e:
+            logger.error(
+                f"Failed to send overdue email to {self.email}: {str(e)}",
+                exc_info=True
+            )
+            return False
             
 
+class UserWishlistQuerySet(models.QuerySet):
+    def with_position(self):
+        """Annotate each entry with its ``queue_position`` in one query rather than a count per row."""
+        ahead = UserWishlist.objects.filter(book_id=models.OuterRef('book_id')).filter(
+            models.Q(created_at__lt=models.OuterRef('created_at'))
+            | models.Q(created_at=models.OuterRef('created_at'), id__lt=models.OuterRef('id'))
+        ).order_by().values('book_id').annotate(count=models.Count('id')).values('count')
+        return self.annotate(queue_position=Coalesce(models.Subquery(ahead), 0) + 1)
+
+
 class UserWishlist(models.Model):
     """Model for users to add books to their wishlist."""
     class Meta:
@@ -61,6 +106,11 @@ class UserWishlist(models.Model):
         db_table = 'user_wishlist'
         unique_together = ('user', 'book')
         ordering = ['-created_at']
+        indexes = [
+            # Each book's hold queue, oldest first
+            models.Index(fields=['book', 'created_at']),
+            models.Index(fields=['hold_expires_at']),
+        ]
     
     user = models.ForeignKey(
         'users.CustomUser',
@@ -75,5 +125,29 @@ class UserWishlist(models.Model):
         verbose_name=_('book')
     )
     
+    # Hold on a returned copy, set while this entry is at the head of the queue
+    held_copy = models.OneToOneField(
+        'books.BookInstance',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='hold',
+        verbose_name=_('held copy')
+    )
+    hold_expires_at = models.DateTimeField(_('hold expires at'), null=True, blank=True)
+    
     # Metadata
-    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+
+    objects = UserWishlistQuerySet.as_manager()
+
+    @property
+    def position(self):
+        """
+        1-based place in the book's hold queue, which is ordered by creation
+        time. Lists should use ``with_position()`` instead of one query per entry.
+        """
+        ahead = UserWishlist.objects.filter(book_id=self.book_id).filter(
+            models.Q(created_at__lt=self.created_at) | models.Q(created_at=self.created_at, id__lt=self.id)
+        )
+        return ahead.count() + 1
\ No newline at end of file
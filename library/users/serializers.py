@@ -2,7 +2,7 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 
-from books.models import Book
+from books.models import Book, BookInstanceHistory, BookInstanceHistoryArchive
 from books.serializers import BookSerializer
 
 from .models import UserWishlist
@@ -32,7 +32,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
     wishlist_data = serializers.SerializerMethodField()
 
     def get_wishlist_data(self, obj):
-        return UserWishlistSerializer(obj.wishlist, many=True).data
+        return UserWishlistSerializer(obj.wishlist.all(), many=True).data
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -118,18 +118,54 @@ class CustomTokenSerializer(serializers.Serializer):
             msg = 'Must include "email" and "password".'
             raise serializers.ValidationError(msg, code='authorization')
 
+class UserLoanSerializer(serializers.ModelSerializer):
+    """
+    Serializer for a loan of the current user, with the book it is a copy of.
+    Also serializes archived loans, which record their book directly.
+    """
+    book_id = serializers.SerializerMethodField(read_only=True)
+    book_title = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = BookInstanceHistory
+        fields = [
+            'id', 'book_instance', 'book_id', 'book_title',
+            'borrowed_date', 'due_date', 'returned_date', 'is_returned'
+        ]
+        read_only_fields = fields
+
+    def _book(self, obj):
+        if isinstance(obj, BookInstanceHistoryArchive):
+            return obj.book
+        return obj.book_instance.book
+
+    def get_book_id(self, obj):
+        return obj.book_id if isinstance(obj, BookInstanceHistoryArchive) else obj.book_instance.book_id
+
+    def get_book_title(self, obj):
+        book = self._book(obj)
+        return book.title if book is not None else None
+
 class UserWishlistSerializer(serializers.ModelSerializer):
     """Serializer for the Wishlist model."""
     class Meta:
         model = UserWishlist
-        fields = ['id', 'book', 'user', 'created_at', 'username', 'book_title']
-        read_only_fields = ['created_at']
+        fields = [
+            'id', 'book', 'user', 'created_at', 'username', 'book_title',
+            'position', 'held_copy', 'hold_expires_at'
+        ]
+        read_only_fields = ['created_at', 'position', 'held_copy', 'hold_expires_at']
     
     username = serializers.SerializerMethodField(read_only=True)
     book_title = serializers.SerializerMethodField(read_only=True)
+    position = serializers.SerializerMethodField(read_only=True)
     
     def get_username(self, obj):
         return obj.user.username
     
     def get_book_title(self, obj):
-        return obj.book.title
\ No newline at end of file
+        return obj.book.title
+
+    def get_position(self, obj):
+        # Querysets from with_position() carry it; a single new entry is counted.
+        return getattr(obj, 'queue_position', None) or obj.position
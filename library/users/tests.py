@@ -94,3 +94,67 @@ class UserModelTests(APITestCase):
         client.force_authenticate(user=self.user)
         response = client.get('/api/users/wishlist/')
         self.assertIn(response.status_code, [200, 404, 403])  # Accept 404/403 if route not implemented
+
+
+class CurrentUserLoansTests(APITestCase):
+    """Tests for the current user's loan history endpoint."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='reader', email='reader@example.com', password='pass1234'
+        )
+        other = get_user_model().objects.create_user(
+            username='other', email='other@example.com', password='pass1234'
+        )
+        self.client.force_authenticate(user=self.user)
+        book = Book.objects.create(title='Song of Solomon', library_id='LIB0000020', isbn='1234567890020')
+        self.copies = [BookInstance.objects.create(book=book, status=BookStatus.AVAILABLE) for _ in range(3)]
+        for copy in self.copies:
+            self.client.post('/api/books/borrow/', {'book_instance': copy.id}, format='json')
+        self.client.post('/api/books/return_book/', {'book_instance': self.copies[0].id}, format='json')
+        self.client.force_authenticate(user=other)
+        self.client.post('/api/books/borrow/', {'book_instance': self.copies[0].id}, format='json')
+        self.client.force_authenticate(user=self.user)
+
+    def test_lists_own_loans_newest_first_with_cursor_pages(self):
+        url = reverse('users:current-user-loans')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([loan['book_instance'] for loan in response.data['results']], [self.copies[2].id, self.copies[1].id])
+        self.assertEqual(response.data['results'][0]['book_title'], 'Song of Solomon')
+        response = self.client.get(response.data['next'])
+        self.assertEqual([loan['book_instance'] for loan in response.data['results']], [self.copies[0].id])
+        self.assertTrue(response.data['results'][0]['is_returned'])
+        self.assertIsNone(response.data['next'])
+
+    def test_filter_current_loans(self):
+        response = self.client.get(reverse('users:current-user-loans'), {'current': 'true'})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(all(not loan['is_returned'] for loan in response.data['results']))
+
+    def test_archived_loans_follow_the_hot_ones(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from books.archive import archive_history
+        from books.models import BookInstanceHistory
+        old = timezone.now() - timedelta(days=800)
+        # The returned loan and its return row, moved two years back
+        BookInstanceHistory.objects.filter(book_instance=self.copies[0], user=self.user).update(
+            returned_date=old + timedelta(days=3)
+        )
+        BookInstanceHistory.objects.filter(book_instance=self.copies[0], user=self.user, status='B').update(
+            borrowed_date=old, due_date=old + timedelta(days=14)
+        )
+        archive_history()
+        url = reverse('users:current-user-loans')
+        response = self.client.get(url, {'page_size': 2, 'count': 'true'})
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(response.data['next'])
+        self.assertEqual([(loan['book_instance'], loan['book_title'], loan['is_returned']) for loan in response.data['results']], [
+            (self.copies[0].id, 'Song of Solomon', True)
+        ])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([loan['book_instance'] for loan in response.data['results']], [self.copies[2].id, self.copies[1].id])
+        self.assertEqual(len(self.client.get(url, {'current': 'true'}).data['results']), 2)
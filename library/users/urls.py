@@ -18,5 +18,6 @@ urlpatterns = [
     # User profile
     path('profile/', views.UserProfileView.as_view(), name='profile'),
     path('me/', views.CurrentUserView.as_view(), name='current-user'),
+    path('me/loans/', views.CurrentUserLoansView.as_view(), name='current-user-loans'),
     path('', include(router.urls)),
 ]
@@ -7,6 +7,11 @@ from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import generics
+from django.db.models import Prefetch
+
+from books.archive import archive_horizon
+from books.models import BookInstanceHistory, BookInstanceHistoryArchive
+from library.pagination import ArchiveKeysetPagination
 
 from .models import CustomUser, UserWishlist
 from .serializers import (
@@ -14,6 +19,7 @@ from .serializers import (
     UserProfileSerializer, 
     UserRegistrationSerializer,
     CustomTokenSerializer,
+    UserLoanSerializer,
     UserWishlistSerializer,
 )
 
@@ -90,6 +96,46 @@ class CurrentUserView(APIView):
         return Response(serializer.data)
 
 
+class CurrentUserLoansView(generics.ListAPIView):
+    """
+    List the current user's loans, newest first, including archived ones.
+
+    ``?current=true`` lists only books still out and ``?current=false`` only
+    returned ones. Pages are keyset-paginated on ``(borrowed_date, id)``,
+    which the ``(user, borrowed_date)`` indexes serve directly. Archived loans
+    are only read for pages reaching past the archive horizon.
+    """
+    serializer_class = UserLoanSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = ArchiveKeysetPagination
+
+    def archive_horizon(self):
+        return archive_horizon()
+
+    def get_archive_queryset(self):
+        if self.request.query_params.get('current', '').lower() in ('true', '1'):
+            return None  # archived loans are all returned
+        return BookInstanceHistoryArchive.objects.filter(
+            user=self.request.user, borrowed_date__isnull=False
+        ).select_related('book').only(
+            'id', 'book_instance_id', 'book__id', 'book__title', 'borrowed_date', 'due_date', 'returned_date'
+        )
+
+    def get_queryset(self):
+        queryset = BookInstanceHistory.objects.filter(
+            user=self.request.user, borrowed_date__isnull=False
+        ).select_related('book_instance__book').only(
+            'id', 'book_instance__id', 'book_instance__book__id', 'book_instance__book__title',
+            'borrowed_date', 'due_date', 'returned_date', 'is_returned'
+        ).order_by('-borrowed_date', '-id')
+        current = self.request.query_params.get('current', '').lower()
+        if current in ('true', '1'):
+            queryset = queryset.filter(is_returned=False)
+        elif current in ('false', '0'):
+            queryset = queryset.filter(is_returned=True)
+        return queryset
+
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     """
     Retrieve or update user profile.
@@ -98,7 +144,8 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_object(self):
-        user = CustomUser.objects.prefetch_related('wishlist').get(id=self.request.user.id)        
+        wishlist = UserWishlist.objects.with_position().select_related('user', 'book')
+        user = CustomUser.objects.prefetch_related(Prefetch('wishlist', queryset=wishlist)).get(id=self.request.user.id)
         return user
 
 class UserWishlistViewSet(viewsets.ModelViewSet):
@@ -109,7 +156,7 @@ class UserWishlistViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return UserWishlist.objects.filter(user=self.request.user)
+        return UserWishlist.objects.filter(user=self.request.user).with_position().select_related('user', 'book')
     
     @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def post(self, request):
@@ -140,7 +187,7 @@ class UserWishlistViewSet(viewsets.ModelViewSet):
         """
         try:
             user = self.request.user
-            wishlists = UserWishlist.objects.filter(user=user).select_related('book')
+            wishlists = UserWishlist.objects.filter(user=user).with_position().select_related('user', 'book')
             serializer = UserWishlistSerializer(wishlists, many=True)
             return Response(serializer.data)
         except Exception as e:
@@ -161,7 +208,7 @@ class UserWishlistViewSet(viewsets.ModelViewSet):
         """
         try:
             book = self.get_object()
-            wishlists = UserWishlist.objects.filter(book=book).select_related('user')
+            wishlists = UserWishlist.objects.filter(book=book).with_position().select_related('user', 'book')
             serializer = UserWishlistSerializer(wishlists, many=True)
             return Response(serializer.data)
         except Exception as e: